@@ -0,0 +1,228 @@
+"""
+Micro-benchmarks of the crypto primitives, run with the benchmark_crypto command
+
+Every benchmark runs against the 2048-bit group of the instance (ELGAMAL_PARAMS).
+Each one is timed over a few rounds, with enough calls per round that a round lasts
+at least min_time seconds, and reports statistics of the per-call time in each round.
+Results are plain dictionaries, which the command saves as JSON and compares with
+the results of another run to catch regressions.
+"""
+
+import datetime
+import platform
+import statistics
+import timeit
+
+from Crypto.Random.random import StrongRandom
+
+from helios import datatypes, utils
+from helios.crypto import backend, utils as cryptoutils
+from helios.workflows import homomorphic
+
+DEFAULT_REPEAT = 5
+DEFAULT_MIN_TIME = 0.2
+
+QUESTION = {'answers': ['a', 'b', 'c'], 'max': 1, 'min': 0,
+            'question': 'Benchmark?', 'short_name': 'Benchmark?',
+            'choice_type': 'approval', 'result_type': 'absolute', 'tally_type': 'homomorphic'}
+
+# name -> function of the fixtures that returns the function to time
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class BenchmarkElection(object):
+    """
+    what ballots and tallies need from an election
+    """
+
+    def __init__(self, public_key, questions):
+        self.public_key = public_key
+        self.questions = questions
+        self.hash = 'benchmark'
+        self.uuid = 'benchmark'
+
+
+class Fixtures(object):
+    """
+    a key pair, and the ballot and ciphertexts that the benchmarks work on
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self.keypair = params.generate_keypair()
+        self.pk = self.keypair.pk
+        self.sk = self.keypair.sk
+        self.pk.precompute_tables()
+
+        self.election = BenchmarkElection(self.pk, [QUESTION])
+        self.plaintexts = homomorphic.EncryptedAnswer.generate_plaintexts(self.pk)
+
+        self.randomness = cryptoutils.random.mpz_lt(self.pk.q)
+        self.ciphertext = self.pk.encrypt_with_r(self.plaintexts[1], self.randomness)
+        self.disjunctive_proof = self.ciphertext.generate_disjunctive_encryption_proof(
+            self.plaintexts, 1, self.randomness, homomorphic.algs.EG_disjunctive_challenge_generator)
+
+        self.dec_factor, self.decryption_proof = self.sk.decryption_factor_and_proof(self.ciphertext)
+
+        self.vote = homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, [[1]])
+        self.vote_dict = datatypes.LDObject.instantiate(self.vote, datatype='legacy/EncryptedVote').toDict()
+        self.vote_json = utils.to_json(self.vote_dict)
+        self.shape = [len(question['answers']) for question in self.election.questions]
+        self.width = homomorphic.ciphertext_width(self.pk)
+        self.vote_packed = homomorphic.pack_ciphertexts(self.vote.choice_ciphertexts(), self.width)
+
+
+@benchmark('random_mpz_lt')
+def random_mpz_lt(fixtures):
+    q = fixtures.pk.q
+    return lambda: cryptoutils.random.mpz_lt(q)
+
+
+@benchmark('random_mpz_lt_unbuffered')
+def random_mpz_lt_unbuffered(fixtures):
+    # the same sampling, reading from the OS for every sample
+    q, unbuffered = fixtures.pk.q, StrongRandom()
+    return lambda: cryptoutils.random_mpz_lt(q, unbuffered)
+
+
+@benchmark('encrypt_with_r')
+def encrypt_with_r(fixtures):
+    return lambda: fixtures.pk.encrypt_with_r(fixtures.plaintexts[1], fixtures.randomness)
+
+
+@benchmark('generate_disjunctive_encryption_proof')
+def generate_disjunctive_encryption_proof(fixtures):
+    return lambda: fixtures.ciphertext.generate_disjunctive_encryption_proof(
+        fixtures.plaintexts, 1, fixtures.randomness, homomorphic.algs.EG_disjunctive_challenge_generator)
+
+
+@benchmark('verify_disjunctive_encryption_proof')
+def verify_disjunctive_encryption_proof(fixtures):
+    return lambda: fixtures.ciphertext.verify_disjunctive_encryption_proof(
+        fixtures.plaintexts, fixtures.disjunctive_proof, homomorphic.algs.EG_disjunctive_challenge_generator)
+
+
+@benchmark('vote_verify')
+def vote_verify(fixtures):
+    return lambda: fixtures.vote.verify(fixtures.election)
+
+
+@benchmark('zkproof_verify')
+def zkproof_verify(fixtures):
+    # the proof of a trustee's decryption factor, legacy/EGZKProof on the wire
+    pk, ciphertext = fixtures.pk, fixtures.ciphertext
+    return lambda: fixtures.decryption_proof.verify(pk.g, ciphertext.alpha, pk.y, fixtures.dec_factor, pk.p, pk.q)
+
+
+@benchmark('decryption_factor_and_proof')
+def decryption_factor_and_proof(fixtures):
+    return lambda: fixtures.sk.decryption_factor_and_proof(fixtures.ciphertext)
+
+
+@benchmark('tally_add_vote')
+def tally_add_vote(fixtures):
+    tally = homomorphic.Tally(election=fixtures.election)
+    tally.add_vote(fixtures.vote, verify_p=False)
+    return lambda: tally.add_vote(fixtures.vote, verify_p=False)
+
+
+@benchmark('tally_add_raw_vote')
+def tally_add_raw_vote(fixtures):
+    # what tallying from the database costs per ballot
+    tally = homomorphic.Tally(election=fixtures.election)
+    return lambda: tally.add_raw_votes([fixtures.vote_json])
+
+
+@benchmark('tally_add_packed_vote')
+def tally_add_packed_vote(fixtures):
+    # what tallying from the packed ciphertexts costs per ballot
+    tally = homomorphic.Tally(election=fixtures.election)
+    return lambda: tally.add_ciphertexts([homomorphic.unpack_ciphertexts(fixtures.vote_packed, fixtures.shape, fixtures.width)])
+
+
+@benchmark('dlog_table_precompute_1000')
+def dlog_table_precompute(fixtures):
+    return lambda: homomorphic.DLogTable(fixtures.pk.g, fixtures.pk.p).precompute(1000)
+
+
+@benchmark('ldobject_vote_from_json')
+def ldobject_vote_from_json(fixtures):
+    return lambda: datatypes.LDObject.fromDict(utils.from_json(fixtures.vote_json), type_hint='legacy/EncryptedVote')
+
+
+@benchmark('ldobject_vote_to_json')
+def ldobject_vote_to_json(fixtures):
+    return lambda: utils.to_json(datatypes.LDObject.instantiate(fixtures.vote, datatype='legacy/EncryptedVote').toDict())
+
+
+def measure(fn, repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+    """
+    statistics, in seconds, of one call to fn
+    """
+    timer = timeit.Timer(fn)
+
+    # enough calls that a round lasts at least min_time
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+
+    per_call = [round_time / number for round_time in timer.repeat(repeat=repeat, number=number)]
+
+    return {
+        'min': min(per_call),
+        'median': statistics.median(per_call),
+        'mean': statistics.mean(per_call),
+        'stdev': statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+        'rounds': repeat,
+        'calls_per_round': number,
+    }
+
+
+def run(params, names=None, repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+    """
+    run the benchmarks called names, all of them by default
+    """
+    unknown = set(names or []) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+    fixtures = Fixtures(params)
+
+    results = {}
+    for name in (names or BENCHMARKS):
+        results[name] = measure(BENCHMARKS[name](fixtures), repeat=repeat, min_time=min_time)
+
+    return {
+        'meta': {
+            'at': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'backend': backend.get_engine().name,
+            'p_bits': params.p.bit_length(),
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    (name, baseline median, median, ratio, regressed) for each benchmark in both runs.
+    A benchmark regressed if its median is more than threshold slower than the baseline's.
+    """
+    comparison = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+
+        baseline_median = baseline['results'][name]['median']
+        ratio = result['median'] / baseline_median
+        comparison.append((name, baseline_median, result['median'], ratio, ratio > 1 + threshold))
+
+    return comparison
@@ -7,11 +7,13 @@ Ben Adida
 ben@adida.net
 """
 
+import functools
 import logging
 
 from Crypto.Hash import SHA1
 from Crypto.Util import number
 
+from helios.crypto import backend, fixedbase, multiexp, randpool
 from helios.crypto.utils import random
 from helios.utils import to_json
 
@@ -58,7 +60,7 @@ class EGKeyPair:
         self.pk.q = q
 
         self.sk.x = random.mpz_lt(q)
-        self.pk.y = pow(g, self.sk.x, p)
+        self.pk.y = backend.powmod(g, self.sk.x, p)
 
         self.sk.pk = self.pk
 
@@ -80,15 +82,15 @@ class EGPublicKey:
         # make sure m is in the right subgroup
         if encode_message:
             y = plaintext.m + 1
-            if pow(y, self.q, self.p) == 1:
+            if backend.powmod(y, self.q, self.p) == 1:
                 m = y
             else:
                 m = -y % self.p
         else:
             m = plaintext.m
 
-        ciphertext.alpha = pow(self.g, r, self.p)
-        ciphertext.beta = (m * pow(self.y, r, self.p)) % self.p
+        ciphertext.alpha = fixedbase.powmod(self.g, r, self.p)
+        ciphertext.beta = backend.mulmod(m, fixedbase.powmod(self.y, r, self.p), self.p)
 
         return ciphertext
 
@@ -96,8 +98,12 @@ class EGPublicKey:
         """
         Encrypt a plaintext and return the randomness just generated and used.
         """
-        r = random.mpz_lt(self.q)
-        ciphertext = self.encrypt_with_r(plaintext, r)
+        r, alpha, y_to_r = randpool.take(self)
+
+        ciphertext = EGCiphertext()
+        ciphertext.pk = self
+        ciphertext.alpha = alpha
+        ciphertext.beta = backend.mulmod(plaintext.m, y_to_r, self.p)
 
         return [ciphertext, r]
 
@@ -107,6 +113,15 @@ class EGPublicKey:
         """
         return self.encrypt_return_r(plaintext)[0]
 
+    def precompute_tables(self):
+        """
+        Build (or fetch from the shared cache) the fixed-base tables for g and y,
+        so that every subsequent exponentiation of g or y with this key is cheap.
+        """
+        exponent_bits = self.q.bit_length()
+        fixedbase.precompute(self.g, self.p, exponent_bits)
+        fixedbase.precompute(self.y, self.p, exponent_bits)
+
     def to_dict(self):
         """
         Serialize to dictionary.
@@ -131,7 +146,7 @@ class EGPublicKey:
         result.p = self.p
         result.q = self.q
         result.g = self.g
-        result.y = (self.y * other.y) % result.p
+        result.y = backend.mulmod(self.y, other.y, result.p)
         return result
 
     def verify_sk_proof(self, dlog_proof, challenge_generator=None):
@@ -139,41 +154,17 @@ class EGPublicKey:
         verify the proof of knowledge of the secret key
         g^response = commitment * y^challenge
         """
-        left_side = pow(self.g, dlog_proof.response, self.p)
-        right_side = (dlog_proof.commitment * pow(self.y, dlog_proof.challenge, self.p)) % self.p
+        check = multiexp.products_equal([(self.g, dlog_proof.response)],
+                                        [(dlog_proof.commitment, 1), (self.y, dlog_proof.challenge)], self.p)
 
         expected_challenge = challenge_generator(dlog_proof.commitment) % self.q
 
-        return (left_side == right_side) and (dlog_proof.challenge == expected_challenge)
+        return check and (dlog_proof.challenge == expected_challenge)
 
     def validate_pk_params(self):
-        # check primality of p
-        if not number.isPrime(self.p):
-            raise Exception("p is not prime.")
-
-        # check length of p
-        if not (number.size(self.p) >= 2048):
-            raise Exception("p of insufficient length. Should be 2048 bits or greater.")
-
-        # check primality of q
-        if not number.isPrime(self.q):
-            raise Exception("q is not prime.")
-
-        # check length of q
-        if not (number.size(self.q) >= 256):
-            raise Exception("q of insufficient length. Should be 256 bits or greater.")
-
-        if pow(self.g, self.q, self.p) != 1:
-            raise Exception("g does not generate subgroup of order q.")
-
-        if not (1 < self.g < self.p - 1):
-            raise Exception("g out of range.")
-
-        if not (1 < self.y < self.p - 1):
-            raise Exception("y out of range.")
-
-        if pow(self.y, self.q, self.p) != 1:
-            raise Exception("g does not generate proper group.")
+        # the same few groups and keys are loaded over and over, the checks are memoized
+        validate_group_params(self.p, self.q, self.g)
+        validate_group_element(self.p, self.q, self.y)
 
     @classmethod
     def from_dict(cls, d):
@@ -205,7 +196,7 @@ class EGSecretKey:
         """
         provide the decryption factor, not yet inverted because of needed proof
         """
-        return pow(ciphertext.alpha, self.x, self.pk.p)
+        return backend.powmod(ciphertext.alpha, self.x, self.pk.p)
 
     def decryption_factor_and_proof(self, ciphertext, challenge_generator=None):
         """
@@ -228,7 +219,7 @@ class EGSecretKey:
         if not dec_factor:
             dec_factor = self.decryption_factor(ciphertext)
 
-        m = (number.inverse(dec_factor, self.pk.p) * ciphertext.beta) % self.pk.p
+        m = backend.mulmod(backend.invert(dec_factor, self.pk.p), ciphertext.beta, self.pk.p)
 
         if decode_m:
             # get m back from the q-order subgroup
@@ -254,13 +245,14 @@ class EGSecretKey:
         and alpha^t = b * beta/m ^ c
         """
 
-        m = (number.inverse(pow(ciphertext.alpha, self.x, self.pk.p), self.pk.p) * ciphertext.beta) % self.pk.p
-        beta_over_m = (ciphertext.beta * number.inverse(m, self.pk.p)) % self.pk.p
+        m = backend.mulmod(backend.invert(backend.powmod(ciphertext.alpha, self.x, self.pk.p), self.pk.p),
+                           ciphertext.beta, self.pk.p)
+        beta_over_m = backend.mulmod(ciphertext.beta, backend.invert(m, self.pk.p), self.pk.p)
 
         # pick a random w
         w = random.mpz_lt(self.pk.q)
-        a = pow(self.pk.g, w, self.pk.p)
-        b = pow(ciphertext.alpha, w, self.pk.p)
+        a = fixedbase.powmod(self.pk.g, w, self.pk.p)
+        b = backend.powmod(ciphertext.alpha, w, self.pk.p)
 
         c = int(SHA1.new(bytes(str(a) + "," + str(b), 'utf-8')).hexdigest(), 16)
 
@@ -285,7 +277,7 @@ class EGSecretKey:
         Prover computes response = w + x*challenge mod q, where x is the secret key.
         """
         w = random.mpz_lt(self.pk.q)
-        commitment = pow(self.pk.g, w, self.pk.p)
+        commitment = fixedbase.powmod(self.pk.g, w, self.pk.p)
         challenge = challenge_generator(commitment) % self.pk.q
         response = (w + (self.x * challenge)) % self.pk.q
 
@@ -343,8 +335,8 @@ class EGCiphertext:
         new = EGCiphertext()
 
         new.pk = self.pk
-        new.alpha = (self.alpha * other.alpha) % self.pk.p
-        new.beta = (self.beta * other.beta) % self.pk.p
+        new.alpha = backend.mulmod(self.alpha, other.alpha, self.pk.p)
+        new.beta = backend.mulmod(self.beta, other.beta, self.pk.p)
 
         return new
 
@@ -354,8 +346,8 @@ class EGCiphertext:
         that's no good when we do plaintext encoding of 1.
         """
         new_c = EGCiphertext()
-        new_c.alpha = (self.alpha * pow(self.pk.g, r, self.pk.p)) % self.pk.p
-        new_c.beta = (self.beta * pow(self.pk.y, r, self.pk.p)) % self.pk.p
+        new_c.alpha = backend.mulmod(self.alpha, fixedbase.powmod(self.pk.g, r, self.pk.p), self.pk.p)
+        new_c.beta = backend.mulmod(self.beta, fixedbase.powmod(self.pk.y, r, self.pk.p), self.pk.p)
         new_c.pk = self.pk
 
         return new_c
@@ -387,15 +379,13 @@ class EGCiphertext:
         """
         Generate the disjunctive encryption proof of encryption
         """
-        # random W
-        w = random.mpz_lt(self.pk.q)
+        # random W, with A=g^w, B=y^w
+        w, g_to_w, y_to_w = randpool.take(self.pk)
 
         # build the proof
         proof = EGZKProof()
-
-        # compute A=g^w, B=y^w
-        proof.commitment['A'] = pow(self.pk.g, w, self.pk.p)
-        proof.commitment['B'] = pow(self.pk.y, w, self.pk.p)
+        proof.commitment['A'] = g_to_w
+        proof.commitment['B'] = y_to_w
 
         # generate challenge
         proof.challenge = challenge_generator(proof.commitment)
@@ -406,27 +396,44 @@ class EGCiphertext:
         return proof
 
     def simulate_encryption_proof(self, plaintext, challenge=None):
-        # generate a random challenge if not provided
-        if not challenge:
-            challenge = random.mpz_lt(self.pk.q)
+        return self.simulate_encryption_proofs([plaintext], [challenge])[0]
 
-        proof = EGZKProof()
-        proof.challenge = challenge
+    def simulate_encryption_proofs(self, plaintexts, challenges=None):
+        """
+        simulate a proof for each plaintext, with all of the modular inversions done in two batches
+        """
+        p, q = self.pk.p, self.pk.q
+        challenges = challenges or [None for _ in plaintexts]
+
+        proofs = []
+        response_powers = []
+        for challenge in challenges:
+            proof = EGZKProof()
+
+            # generate a random challenge if not provided
+            proof.challenge = challenge or random.mpz_lt(q)
+
+            # random response, does not even need to depend on the challenge
+            proof.response, g_to_response, y_to_response = randpool.take(self.pk)
+            proofs.append(proof)
+            response_powers.append((g_to_response, y_to_response))
 
         # compute beta/plaintext, the completion of the DH tuple
-        beta_over_plaintext = (self.beta * number.inverse(plaintext.m, self.pk.p)) % self.pk.p
+        plaintext_inverses = backend.batch_invert([plaintext.m for plaintext in plaintexts], p)
+        betas_over_plaintexts = [backend.mulmod(self.beta, inverse, p) for inverse in plaintext_inverses]
 
-        # random response, does not even need to depend on the challenge
-        proof.response = random.mpz_lt(self.pk.q)
+        # now we compute A = g^response / alpha^challenge and B = y^response / (beta/plaintext)^challenge
+        powers = []
+        for proof, beta_over_plaintext in zip(proofs, betas_over_plaintexts):
+            powers.append(backend.powmod(self.alpha, proof.challenge, p))
+            powers.append(backend.powmod(beta_over_plaintext, proof.challenge, p))
+        power_inverses = backend.batch_invert(powers, p)
 
-        # now we compute A and B
-        proof.commitment['A'] = (number.inverse(pow(self.alpha, proof.challenge, self.pk.p), self.pk.p)
-                                 * pow(self.pk.g, proof.response, self.pk.p)
-                                 ) % self.pk.p
-        proof.commitment['B'] = (number.inverse(pow(beta_over_plaintext, proof.challenge, self.pk.p), self.pk.p) * pow(
-            self.pk.y, proof.response, self.pk.p)) % self.pk.p
+        for proof_num, (g_to_response, y_to_response) in enumerate(response_powers):
+            proofs[proof_num].commitment['A'] = backend.mulmod(power_inverses[2 * proof_num], g_to_response, p)
+            proofs[proof_num].commitment['B'] = backend.mulmod(power_inverses[2 * proof_num + 1], y_to_response, p)
 
-        return proof
+        return proofs
 
     def generate_disjunctive_encryption_proof(self, plaintexts, real_index, randomness, challenge_generator):
         # note how the interface is as such so that the result does not reveal which is the real proof.
@@ -434,9 +441,10 @@ class EGCiphertext:
         proofs = [None for _ in plaintexts]
 
         # go through all plaintexts and simulate the ones that must be simulated.
-        for p_num in range(len(plaintexts)):
-            if p_num != real_index:
-                proofs[p_num] = self.simulate_encryption_proof(plaintexts[p_num])
+        simulated_nums = [p_num for p_num in range(len(plaintexts)) if p_num != real_index]
+        simulated_proofs = self.simulate_encryption_proofs([plaintexts[p_num] for p_num in simulated_nums])
+        for p_num, simulated_proof in zip(simulated_nums, simulated_proofs):
+            proofs[p_num] = simulated_proof
 
         # the function that generates the challenge
         def real_challenge_generator(commitment):
@@ -465,33 +473,37 @@ class EGCiphertext:
 
         return EGZKDisjunctiveProof(proofs)
 
-    def verify_encryption_proof(self, plaintext, proof):
+    def verify_encryption_proof(self, plaintext, proof, plaintext_inverse=None):
         """
         Checks for the DDH tuple g, y, alpha, beta/plaintext.
         (PoK of randomness r.)
 
         Proof contains commitment = {A, B}, challenge, response
+        plaintext_inverse, 1/plaintext, is computed if not given.
         """
         # check that A, B are in the correct group
-        if not (pow(proof.commitment['A'], self.pk.q, self.pk.p) == 1 and pow(proof.commitment['B'], self.pk.q,
+        if not (backend.powmod(proof.commitment['A'], self.pk.q, self.pk.p) == 1 and backend.powmod(proof.commitment['B'], self.pk.q,
                                                                               self.pk.p) == 1):
             return False
 
         # check that g^response = A * alpha^challenge
-        first_check = (pow(self.pk.g, proof.response, self.pk.p) == (
-                (pow(self.alpha, proof.challenge, self.pk.p) * proof.commitment['A']) % self.pk.p))
+        first_check = multiexp.products_equal([(self.pk.g, proof.response)],
+                                              [(proof.commitment['A'], 1), (self.alpha, proof.challenge)], self.pk.p)
 
         # check that y^response = B * (beta/m)^challenge
-        beta_over_m = (self.beta * number.inverse(plaintext.m, self.pk.p)) % self.pk.p
-        second_check = (pow(self.pk.y, proof.response, self.pk.p) == (
-                (pow(beta_over_m, proof.challenge, self.pk.p) * proof.commitment['B']) % self.pk.p))
+        if plaintext_inverse is None:
+            plaintext_inverse = backend.invert(plaintext.m, self.pk.p)
+        beta_over_m = backend.mulmod(self.beta, plaintext_inverse, self.pk.p)
+        second_check = multiexp.products_equal([(self.pk.y, proof.response)],
+                                               [(proof.commitment['B'], 1), (beta_over_m, proof.challenge)], self.pk.p)
 
         # print "1,2: %s %s " % (first_check, second_check)
         return first_check and second_check
 
-    def verify_disjunctive_encryption_proof(self, plaintexts, proof, challenge_generator):
+    def verify_disjunctive_encryption_proof(self, plaintexts, proof, challenge_generator, plaintext_inverses=None):
         """
         plaintexts and proofs are all lists of equal length, with matching.
+        plaintext_inverses, the inverses of the plaintexts, are computed if not given.
 
         overall_challenge is what all of the challenges combined should yield.
         """
@@ -499,9 +511,13 @@ class EGCiphertext:
             print("bad number of proofs (expected %s, found %s)" % (len(plaintexts), len(proof.proofs)))
             return False
 
+        # invert all of the plaintexts at once
+        if plaintext_inverses is None:
+            plaintext_inverses = backend.batch_invert([plaintext.m for plaintext in plaintexts], self.pk.p)
+
         for i in range(len(plaintexts)):
             # if a proof fails, stop right there
-            if not self.verify_encryption_proof(plaintexts[i], proof.proofs[i]):
+            if not self.verify_encryption_proof(plaintexts[i], proof.proofs[i], plaintext_inverses[i]):
                 print("bad proof %s, %s, %s" % (i, plaintexts[i], proof.proofs[i]))
                 return False
 
@@ -529,11 +545,12 @@ class EGCiphertext:
         decrypt a ciphertext given a list of decryption factors (from multiple trustees)
         For now, no support for threshold
         """
-        running_decryption = self.beta
+        # a single inversion, of the product of the factors
+        factors_product = 1
         for dec_factor in decryption_factors:
-            running_decryption = (running_decryption * number.inverse(dec_factor, public_key.p)) % public_key.p
+            factors_product = backend.mulmod(factors_product, dec_factor, public_key.p)
 
-        return running_decryption
+        return backend.mulmod(self.beta, backend.invert(factors_product, public_key.p), public_key.p)
 
     def check_group_membership(self, pk):
         """
@@ -545,10 +562,10 @@ class EGCiphertext:
         elif not (1 < self.beta < pk.p - 1):
             return False
 
-        elif pow(self.alpha, pk.q, pk.p) != 1:
+        elif backend.powmod(self.alpha, pk.q, pk.p) != 1:
             return False
 
-        elif pow(self.beta, pk.q, pk.p) != 1:
+        elif backend.powmod(self.beta, pk.q, pk.p) != 1:
             return False
 
         else:
@@ -601,8 +618,8 @@ class EGZKProof(object):
         proof = cls()
 
         # compute A = little_g^w, B=little_h^w
-        proof.commitment['A'] = pow(little_g, w, p)
-        proof.commitment['B'] = pow(little_h, w, p)
+        proof.commitment['A'] = fixedbase.powmod(little_g, w, p)
+        proof.commitment['B'] = backend.powmod(little_h, w, p)
 
         # get challenge
         proof.challenge = challenge_generator(proof.commitment)
@@ -637,15 +654,15 @@ class EGZKProof(object):
         Verify a DH tuple proof
         """
         # check that A, B are in the correct group
-        if not (pow(self.commitment['A'], self.pk.q, self.pk.p) == 1
-                and pow(self.commitment['B'], self.pk.q, self.pk.p) == 1):
+        if not (backend.powmod(self.commitment['A'], q, p) == 1
+                and backend.powmod(self.commitment['B'], q, p) == 1):
             return False
 
         # check that little_g^response = A * big_g^challenge
-        first_check = (pow(little_g, self.response, p) == ((pow(big_g, self.challenge, p) * self.commitment['A']) % p))
+        first_check = multiexp.products_equal([(little_g, self.response)], [(self.commitment['A'], 1), (big_g, self.challenge)], p)
 
         # check that little_h^response = B * big_h^challenge
-        second_check = (pow(little_h, self.response, p) == ((pow(big_h, self.challenge, p) * self.commitment['B']) % p))
+        second_check = multiexp.products_equal([(little_h, self.response)], [(self.commitment['B'], 1), (big_h, self.challenge)], p)
 
         # check the challenge?
         third_check = True
@@ -691,6 +708,48 @@ class DLogProof(object):
     fromJSONDict = from_dict
 
 
+@functools.lru_cache(maxsize=None)
+def validate_group_params(p, q, g):
+    """
+    raises an exception if (p, q, g) is not a proper group.
+    Only parameters that pass are memoized.
+    """
+    # check primality of p
+    if not number.isPrime(p):
+        raise Exception("p is not prime.")
+
+    # check length of p
+    if not (number.size(p) >= 2048):
+        raise Exception("p of insufficient length. Should be 2048 bits or greater.")
+
+    # check primality of q
+    if not number.isPrime(q):
+        raise Exception("q is not prime.")
+
+    # check length of q
+    if not (number.size(q) >= 256):
+        raise Exception("q of insufficient length. Should be 256 bits or greater.")
+
+    if backend.powmod(g, q, p) != 1:
+        raise Exception("g does not generate subgroup of order q.")
+
+    if not (1 < g < p - 1):
+        raise Exception("g out of range.")
+
+
+@functools.lru_cache(maxsize=4096)
+def validate_group_element(p, q, y):
+    """
+    raises an exception if y is not in the subgroup of order q of a validated group.
+    Only elements that pass are memoized, keyed with their group.
+    """
+    if not (1 < y < p - 1):
+        raise Exception("y out of range.")
+
+    if backend.powmod(y, q, p) != 1:
+        raise Exception("g does not generate proper group.")
+
+
 def EG_disjunctive_challenge_generator(commitments):
     array_to_hash = []
     for commitment in commitments:
@@ -0,0 +1,142 @@
+"""
+Big-integer arithmetic backend for the Helios Voting System
+
+The modular arithmetic of the crypto modules goes through this module, so that it
+can run on a faster engine when one is available:
+
+  python   Python ints and the built-in pow(), always available
+  gmpy2    GMP through gmpy2, picked automatically when gmpy2 is installed
+
+Whatever the engine, every function takes and returns plain Python ints, so nothing
+outside of this module (the wire format in particular) can tell which one is in use.
+Set HELIOS_CRYPTO_BACKEND to force an engine.
+"""
+
+import os
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+
+class PythonEngine(object):
+    name = 'python'
+
+    def native(self, x):
+        """
+        the engine's own representation of x, for loops that multiply many times
+        """
+        return x
+
+    def powmod(self, base, exponent, modulus):
+        return pow(base, exponent, modulus)
+
+    def invert(self, x, modulus):
+        return pow(x, -1, modulus)
+
+    def mulmod(self, a, b, modulus):
+        return (a * b) % modulus
+
+
+class GMPEngine(object):
+    name = 'gmpy2'
+
+    def native(self, x):
+        return gmpy2.mpz(x)
+
+    def powmod(self, base, exponent, modulus):
+        return int(gmpy2.powmod(base, exponent, modulus))
+
+    def invert(self, x, modulus):
+        # same error as pow(x, -1, modulus)
+        try:
+            return int(gmpy2.invert(x, modulus))
+        except ZeroDivisionError:
+            raise ValueError("base is not invertible for the given modulus")
+
+    def mulmod(self, a, b, modulus):
+        return int((gmpy2.mpz(a) * b) % modulus)
+
+
+ENGINES = {
+    'python': PythonEngine,
+    'gmpy2': GMPEngine,
+}
+
+engine = None
+
+
+def set_engine(name):
+    global engine
+
+    if name not in ENGINES:
+        raise ValueError("unknown arithmetic backend %s" % name)
+
+    if name == 'gmpy2' and gmpy2 is None:
+        raise ImportError("the gmpy2 arithmetic backend needs gmpy2 installed")
+
+    engine = ENGINES[name]()
+    return engine
+
+
+def get_engine():
+    return engine
+
+
+set_engine(os.environ.get('HELIOS_CRYPTO_BACKEND') or ('gmpy2' if gmpy2 is not None else 'python'))
+
+
+def native(x):
+    return engine.native(x)
+
+
+def powmod(base, exponent, modulus):
+    return engine.powmod(base, exponent, modulus)
+
+
+def invert(x, modulus):
+    return engine.invert(x, modulus)
+
+
+def mulmod(a, b, modulus):
+    return engine.mulmod(a, b, modulus)
+
+
+def batch_invert(values, modulus):
+    """
+    the inverses of all of the values mod modulus, with Montgomery's trick:
+    one modular inversion and 3(n-1) multiplications instead of n inversions.
+    Raises ValueError if any of the values is not invertible.
+    """
+    values = list(values)
+    if not values:
+        return []
+
+    native_modulus = engine.native(modulus)
+
+    # prefix_products[i] = values[0] * ... * values[i]
+    prefix_products = []
+    running_product = engine.native(1)
+    for value in values:
+        running_product = (running_product * value) % native_modulus
+        prefix_products.append(running_product)
+
+    # walk back down, peeling one value off the inverse of the product at a time
+    inverse = engine.native(engine.invert(int(running_product), modulus))
+    inverses = [None] * len(values)
+    for i in range(len(values) - 1, 0, -1):
+        inverses[i] = int((inverse * prefix_products[i - 1]) % native_modulus)
+        inverse = (inverse * values[i]) % native_modulus
+    inverses[0] = int(inverse)
+
+    return inverses
+
+
+def multi_powmod(pairs, modulus):
+    """
+    product of base^exponent mod modulus over (base, exponent) pairs
+    """
+    # multiexp builds on this module
+    from helios.crypto import multiexp
+    return multiexp.multi_powmod(pairs, modulus)
@@ -0,0 +1,170 @@
+"""
+Batch verification of ElGamal disjunctive encryption proofs
+
+Each sub-proof of a disjunctive proof that (alpha, beta) encrypts plaintext m
+is checked with two equations:
+
+  g^response = A * alpha^challenge
+  y^response = B * (beta/m)^challenge
+
+Rather than checking each equation separately, we raise each one to a fresh random
+exponent (the "small exponents" test of Bellare, Garay and Rabin) and multiply them all
+together, so that a whole batch is checked with a single equation:
+
+  g^(sum d*response) * y^(sum d'*response) * prod m^(sum d'*challenge)
+    == prod A^d * alpha^(sum d*challenge) * B^d' * beta^(sum d'*challenge)
+
+Exponents of a shared base (g, y, the plaintexts, the alpha and beta common to
+the sub-proofs of a disjunction) are summed, and all the remaining bases share a single
+interleaved multi-exponentiation.
+A batch that contains a bad proof passes with probability at most 2^-security_bits,
+for the order-q component of every element.
+
+That bound says nothing about the other components: with an even weight, a sub-proof
+whose A or B was negated still passes. So the alpha and beta of every ciphertext, and the
+A and B commitments of every sub-proof, also go through a SubgroupMembershipBatch. In each of security_bits rounds,
+it raises the product of a random subset of the elements to q: if an element is outside
+of the order-q subgroup, adding it to or removing it from the subset changes whether
+the round passes, so each round catches a bad batch with probability at least 1/2.
+A round costs one exponentiation and a multiplication for half of the elements, rather
+than an exponentiation for each element.
+
+When a batch fails, the caller is expected to split it and retry to find the bad proofs.
+"""
+
+from helios.crypto import backend, multiexp
+from helios.crypto.utils import random
+
+DEFAULT_SECURITY_BITS = 64
+
+
+class SubgroupMembershipBatch(object):
+    """
+    Accumulates elements of Z_p^* that must be in the subgroup of order q.
+    """
+
+    def __init__(self, p, q, security_bits=DEFAULT_SECURITY_BITS):
+        self.p = p
+        self.q = q
+        self.security_bits = security_bits
+        self.elements = set()
+
+    def add(self, elements):
+        """
+        add elements to the batch. Their range is checked right away:
+        returns False if one is out of range, in which case nothing is added.
+        """
+        elements = list(elements)
+        if not all(1 < element < self.p - 1 for element in elements):
+            return False
+
+        self.elements.update(elements)
+        return True
+
+    def _batch_is_cheaper(self):
+        # an exponentiation to q costs about as much as q.bit_length() multiplications
+        exponentiation_cost = self.q.bit_length()
+        num_elements = len(self.elements)
+        return self.security_bits * (exponentiation_cost + num_elements // 2) < num_elements * exponentiation_cost
+
+    def verify(self):
+        """
+        check every element added so far at once
+        """
+        if not self._batch_is_cheaper():
+            return all(backend.powmod(element, self.q, self.p) == 1 for element in self.elements)
+
+        elements = [backend.native(element) for element in self.elements]
+        modulus = backend.native(self.p)
+
+        for _ in range(self.security_bits):
+            subset = format(random.getrandbits(len(elements)), '0%db' % len(elements))
+
+            product = backend.native(1)
+            for element, in_subset in zip(elements, subset):
+                if in_subset == '1':
+                    product = (product * element) % modulus
+
+            if backend.powmod(product, self.q, self.p) != 1:
+                return False
+
+        return True
+
+
+class DisjunctiveProofBatch(object):
+    """
+    Accumulates disjunctive encryption proofs made with the same public key.
+    """
+
+    def __init__(self, pk, security_bits=DEFAULT_SECURITY_BITS):
+        self.pk = pk
+        self.security_bits = security_bits
+
+        # base -> exponent, for each side of the combined equation
+        self.left = {}
+        self.right = {}
+
+        self.membership = SubgroupMembershipBatch(pk.p, pk.q, security_bits)
+
+        self.num_proofs = 0
+
+    def _random_weight(self):
+        return random.getrandbits(self.security_bits) + 1
+
+    def _accumulate(self, side, base, exponent):
+        side[base] = side.get(base, 0) + exponent
+
+    def add(self, ciphertext, plaintexts, proof, challenge_generator):
+        """
+        add one disjunctive proof to the batch.
+
+        The structural checks (number of proofs, overall challenge, range of the ciphertext
+        and of the commitments) are done right away: returns False if they fail, in which case
+        nothing is added to the batch.
+        """
+        if len(plaintexts) != len(proof.proofs):
+            return False
+
+        # the overall challenge only needs a hash, no need to defer it
+        if challenge_generator([p.commitment for p in proof.proofs]) != (sum([p.challenge for p in proof.proofs]) % self.pk.q):
+            return False
+
+        commitments = [sub_proof.commitment[name] for sub_proof in proof.proofs for name in ('A', 'B')]
+        if not self.membership.add([ciphertext.alpha, ciphertext.beta] + commitments):
+            return False
+
+        g, y = self.pk.g, self.pk.y
+
+        for plaintext, sub_proof in zip(plaintexts, proof.proofs):
+            weight_1 = self._random_weight()
+            weight_2 = self._random_weight()
+
+            # g^response = A * alpha^challenge
+            self._accumulate(self.left, g, weight_1 * sub_proof.response)
+            self._accumulate(self.right, sub_proof.commitment['A'], weight_1)
+            self._accumulate(self.right, ciphertext.alpha, weight_1 * sub_proof.challenge)
+
+            # y^response * m^challenge = B * beta^challenge
+            self._accumulate(self.left, y, weight_2 * sub_proof.response)
+            self._accumulate(self.left, plaintext.m, weight_2 * sub_proof.challenge)
+            self._accumulate(self.right, sub_proof.commitment['B'], weight_2)
+            self._accumulate(self.right, ciphertext.beta, weight_2 * sub_proof.challenge)
+
+        self.num_proofs += 1
+        return True
+
+    def verify(self):
+        """
+        check every proof added so far at once
+        """
+        if self.num_proofs == 0:
+            return True
+
+        # g and y have order q, which keeps their exponents within the fixed-base tables
+        for base in (self.pk.g, self.pk.y):
+            self.left[base] %= self.pk.q
+
+        if not self.membership.verify():
+            return False
+
+        return multiexp.products_equal(list(self.left.items()), list(self.right.items()), self.pk.p)
@@ -0,0 +1,175 @@
+"""
+Persistent discrete log table for the Helios Voting System
+
+Every election on an instance usually shares the same group, so the table of g^k that
+tally decryption needs is the same everywhere. This module stores it once, in a flat
+file that every process maps into memory: the operating system shares the pages, so
+a lookup costs a couple of memory reads and there is nothing to build per process.
+
+The file is an open-addressing hash table (linear probing) of fixed-size slots:
+
+  header   MAGIC, format version, number of slots, bound, then p and g
+  slots    (low 64 bits of g^k, k + 1), little-endian, k + 1 == 0 for an empty slot
+
+Slots only record the low bits of g^k, so a hit is confirmed with an exponentiation.
+A process keeps the file it mapped first: restart workers after rebuilding a table.
+"""
+
+import mmap
+import os
+import struct
+import threading
+
+from helios.crypto import backend, fixedbase
+
+MAGIC = b'HELIOSDL'
+VERSION = 1
+
+# magic, version, number of slots, bound, length of p, length of g
+HEADER = struct.Struct('<8sIQQII')
+SLOT = struct.Struct('<QI')
+
+KEY_MASK = (1 << 64) - 1
+
+# largest k that fits in a slot
+MAX_BOUND = (1 << 32) - 2
+
+_mmaps = {}
+_mmaps_lock = threading.Lock()
+
+
+def _int_to_bytes(value):
+    return value.to_bytes((value.bit_length() + 7) // 8 or 1, 'big')
+
+
+def _num_slots(bound):
+    # a load factor of at most 1/2 keeps probe sequences short
+    num_slots = 1
+    while num_slots < 2 * (bound + 1):
+        num_slots <<= 1
+    return num_slots
+
+
+def _get_mmap(path):
+    with _mmaps_lock:
+        if path not in _mmaps:
+            with open(path, 'rb') as f:
+                _mmaps[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return _mmaps[path]
+
+
+class DLogFileTable(object):
+    """
+    A memory-mapped table of discrete logs in [0, bound], with the same
+    precompute/lookup interface as the in-memory tables of the tally.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mmap = _get_mmap(path)
+        self.up_to = None
+
+        magic, version, self.num_slots, self.bound, modulus_len, base_len = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a discrete log table" % path)
+
+        offset = HEADER.size
+        self.modulus = int.from_bytes(self.mmap[offset:offset + modulus_len], 'big')
+        offset += modulus_len
+        self.base = int.from_bytes(self.mmap[offset:offset + base_len], 'big')
+        self.slots_offset = offset + base_len
+
+        if len(self.mmap) != self.slots_offset + self.num_slots * SLOT.size:
+            raise ValueError("discrete log table %s is truncated" % path)
+
+    @classmethod
+    def build(cls, path, base, modulus, bound):
+        """
+        write the table of base^k for k in [0, bound] to path
+        """
+        if bound > MAX_BOUND:
+            raise ValueError("bound %s is too large, at most %s" % (bound, MAX_BOUND))
+
+        modulus_bytes, base_bytes = _int_to_bytes(modulus), _int_to_bytes(base)
+        num_slots = _num_slots(bound)
+        slot_mask = num_slots - 1
+        slots_offset = HEADER.size + len(modulus_bytes) + len(base_bytes)
+        size = slots_offset + num_slots * SLOT.size
+
+        # write next to the final file, so that readers never see a partial table
+        tmp_path = "%s.tmp" % path
+        with open(tmp_path, 'w+b') as f:
+            f.truncate(size)
+            table = mmap.mmap(f.fileno(), size)
+
+            native_modulus = backend.native(modulus)
+            native_base = backend.native(base) % native_modulus
+            value = backend.native(1)
+
+            for k in range(bound + 1):
+                key = int(value & KEY_MASK)
+                slot = key & slot_mask
+                while SLOT.unpack_from(table, slots_offset + slot * SLOT.size)[1]:
+                    slot = (slot + 1) & slot_mask
+                SLOT.pack_into(table, slots_offset + slot * SLOT.size, key, k + 1)
+
+                value = (value * native_base) % native_modulus
+
+            HEADER.pack_into(table, 0, MAGIC, VERSION, num_slots, bound, len(modulus_bytes), len(base_bytes))
+            table[HEADER.size:slots_offset] = modulus_bytes + base_bytes
+            table.flush()
+            table.close()
+
+        os.replace(tmp_path, path)
+
+        with _mmaps_lock:
+            _mmaps.pop(path, None)
+
+        return cls(path)
+
+    def matches(self, base, modulus):
+        return self.base == base and self.modulus == modulus
+
+    def precompute(self, up_to):
+        """
+        nothing to compute, only restrict lookups to [0, up_to]
+        """
+        if up_to > self.bound:
+            raise ValueError("discrete log table %s only goes up to %s" % (self.path, self.bound))
+        self.up_to = up_to
+
+    def lookup(self, value):
+        """
+        the discrete log of value if it is in [0, up_to], None otherwise
+        """
+        up_to = self.bound if self.up_to is None else self.up_to
+        value = value % self.modulus
+        key = value & KEY_MASK
+
+        slot_mask = self.num_slots - 1
+        slot = key & slot_mask
+        while True:
+            slot_key, k_plus_one = SLOT.unpack_from(self.mmap, self.slots_offset + slot * SLOT.size)
+            if not k_plus_one:
+                return None
+
+            k = k_plus_one - 1
+            if slot_key == key and fixedbase.powmod(self.base, k, self.modulus) == value:
+                return k if k <= up_to else None
+
+            slot = (slot + 1) & slot_mask
+
+
+def open_table(path, base, modulus, up_to=0):
+    """
+    the table at path if it exists, was built for these parameters and goes up to up_to,
+    None otherwise.
+    """
+    if not path or not os.path.exists(path):
+        return None
+
+    table = DLogFileTable(path)
+    if not table.matches(base, modulus) or table.bound < up_to:
+        return None
+
+    return table
@@ -280,8 +280,7 @@ class EncryptedAnswer(HeliosObject):
                 num_selected_answers += 1
 
             # randomness and encryption
-            randomness[answer_num] = utils.random.mpz_lt(pk.q)
-            choices[answer_num] = pk.encrypt_with_r(plaintexts[plaintext_index], randomness[answer_num])
+            choices[answer_num], randomness[answer_num] = pk.encrypt_return_r(plaintexts[plaintext_index])
 
             # generate proof
             individual_proofs[answer_num] = choices[answer_num].generate_disjunctive_encryption_proof(plaintexts,
@@ -347,6 +346,9 @@ class EncryptedVote(HeliosObject):
             logging.error(f"Incorrect election_uuid {our_election_uuid} vs {actual_election_uuid} ")
             return False
 
+        # g and y are the bases of most of the exponentiations below
+        election.public_key.precompute_tables()
+
         # check proofs on all of answers
         for question_num in range(len(election.questions)):
             ea = self.encrypted_answers[question_num]
@@ -384,6 +386,7 @@ class EncryptedVote(HeliosObject):
     @classmethod
     def fromElectionAndAnswers(cls, election, answers):
         pk = election.public_key
+        pk.precompute_tables()
 
         # each answer is an index into the answer array
         encrypted_answers = [EncryptedAnswer.fromElectionAndAnswer(election, answer_num, answers[answer_num]) for
@@ -0,0 +1,124 @@
+"""
+Fixed-base exponentiation for the Helios Voting System
+
+Almost every exponentiation Helios does uses one of two bases that never change
+for the life of an election: the group generator g and the election public key y.
+For a fixed base we can precompute, once, the powers base^(d * 2^(w*i)) for every
+w-bit digit d and every window i, after which an exponentiation is just one modular
+multiplication per window of the exponent instead of a full square-and-multiply.
+
+Tables are cached at the module level, keyed by (modulus, base), so every public key
+that shares the same parameters (for example the global g of ELGAMAL_PARAMS) also
+shares the same table.
+"""
+
+import threading
+from collections import OrderedDict
+
+from helios.crypto import backend
+
+# 6-bit windows are a good tradeoff for 256-bit exponents:
+# 43 multiplications per exponentiation for a table of ~2700 group elements.
+DEFAULT_WINDOW = 6
+
+# bound on the number of tables kept in memory (g is shared, y is per election)
+MAX_TABLES = 32
+
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+class FixedBaseTable(object):
+    """
+    Windowed precomputation table for exponentiations of a single base.
+    Handles any exponent in [0, 2^exponent_bits), falls back to pow() otherwise.
+    """
+
+    def __init__(self, base, modulus, exponent_bits, window=DEFAULT_WINDOW):
+        self.base = base
+        self.modulus = modulus
+        self.exponent_bits = exponent_bits
+        self.window = window
+
+        num_windows = (exponent_bits + window - 1) // window
+        num_digits = 1 << window
+
+        # rows[i][d] = base^(d * 2^(window * i)), in the arithmetic backend's representation
+        self.rows = []
+        modulus = backend.native(modulus)
+        row_base = backend.native(base) % modulus
+        for _ in range(num_windows):
+            row = [backend.native(1), row_base]
+            for _ in range(2, num_digits):
+                row.append((row[-1] * row_base) % modulus)
+            self.rows.append(row)
+
+            # base^(2^(window * (i+1))) is the next row's base
+            row_base = (row[-1] * row_base) % modulus
+
+    def pow(self, exponent):
+        if exponent < 0 or exponent.bit_length() > self.exponent_bits:
+            return backend.powmod(self.base, exponent, self.modulus)
+
+        modulus = backend.native(self.modulus)
+        mask = (1 << self.window) - 1
+        result = 1
+
+        for row in self.rows:
+            if not exponent:
+                break
+
+            digit = exponent & mask
+            if digit:
+                result = (result * row[digit]) % modulus
+
+            exponent >>= self.window
+
+        return int(result)
+
+
+def get_table(base, modulus):
+    """
+    the cached table for this base, or None if it was never precomputed
+    """
+    return _tables.get((modulus, base))
+
+
+def precompute(base, modulus, exponent_bits, window=DEFAULT_WINDOW):
+    """
+    build the table for this base if needed, and return it
+    """
+    key = (modulus, base)
+
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is not None and table.exponent_bits >= exponent_bits:
+            _tables.move_to_end(key)
+            return table
+
+    # build outside of the lock, a concurrent duplicate build is harmless
+    table = FixedBaseTable(base, modulus, exponent_bits, window)
+
+    with _tables_lock:
+        _tables[key] = table
+        _tables.move_to_end(key)
+        while len(_tables) > MAX_TABLES:
+            _tables.popitem(last=False)
+
+    return table
+
+
+def powmod(base, exponent, modulus):
+    """
+    base^exponent mod modulus, using a precomputed table when there is one
+    """
+    table = _tables.get((modulus, base))
+    if table is None:
+        return backend.powmod(base, exponent, modulus)
+
+    return table.pow(exponent)
+
+
+def clear():
+    with _tables_lock:
+        _tables.clear()
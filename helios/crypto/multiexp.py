@@ -0,0 +1,155 @@
+"""
+Simultaneous multi-exponentiation for the Helios Voting System
+
+Proof checks compute products such as A * alpha^c or g^r * y^c. Done with one pow()
+per factor, every factor pays for its own chain of squarings. Straus' method (also
+known as Shamir's trick) walks all the exponents at once, from the top bit down, so
+the whole product shares a single chain of squarings and each base only adds its
+own multiplications. With sliding windows over each exponent, a base costs roughly
+bits/(window+1) multiplications on top of a small table of its odd powers.
+
+Bases that have a fixed-base table (see fixedbase) are cheaper through their table,
+so they are taken out of the interleaved loop.
+"""
+
+from helios.crypto import backend, fixedbase
+
+
+def window_size(bits):
+    """
+    sliding window width that minimizes multiplications for an exponent of this size
+    """
+    for window, max_bits in ((1, 8), (2, 24), (3, 80), (4, 240)):
+        if bits <= max_bits:
+            return window
+    return 5
+
+
+def _odd_powers(base, window, modulus):
+    """
+    base^1, base^3, ..., base^(2^window - 1)
+    """
+    powers = [base]
+    if window > 1:
+        square = (base * base) % modulus
+        for _ in range((1 << (window - 1)) - 1):
+            powers.append((powers[-1] * square) % modulus)
+    return powers
+
+
+def _sliding_windows(exponent, window):
+    """
+    decompose exponent into (bit position, odd digit) pairs, digits at most window bits wide
+    """
+    mask = (1 << window) - 1
+    digits = []
+    position = 0
+    while exponent:
+        if exponent & 1:
+            digits.append((position, exponent & mask))
+            exponent >>= window
+            position += window
+        else:
+            exponent >>= 1
+            position += 1
+    return digits
+
+
+def straus(pairs, modulus, window=None):
+    """
+    product of base^exponent over (base, exponent) pairs, with non-negative exponents,
+    by interleaved sliding-window exponentiation. window=1 is plain Straus/Shamir.
+    """
+    # bit position -> the odd powers to multiply in once the squarings reach it
+    schedule = {}
+    top = -1
+    modulus = backend.native(modulus)
+
+    for base, exponent in pairs:
+        base = backend.native(base) % modulus
+        if exponent == 0 or base == 1:
+            continue
+
+        base_window = window or window_size(exponent.bit_length())
+        powers = _odd_powers(base, base_window, modulus)
+
+        for position, digit in _sliding_windows(exponent, base_window):
+            schedule.setdefault(position, []).append(powers[digit >> 1])
+            top = max(top, position)
+
+    result = backend.native(1)
+    for position in range(top, -1, -1):
+        if result != 1:
+            result = (result * result) % modulus
+        for value in schedule.get(position, ()):
+            result = (result * value) % modulus
+
+    return int(result)
+
+
+def multi_powmod(pairs, modulus, window=None):
+    """
+    product of base^exponent mod modulus over (base, exponent) pairs.
+
+    Bases with a fixed-base table use it, the others are interleaved. Negative
+    exponents are allowed: the base is inverted (or, for a table base, the power),
+    so a check like g^r == A * alpha^c can be written multi_powmod([(g, r), (alpha, -c)]) == A.
+    """
+    interleaved = []
+    numerator = 1
+    denominator = 1
+
+    for base, exponent in pairs:
+        table = fixedbase.get_table(base, modulus)
+        if table is not None:
+            if exponent < 0:
+                denominator = backend.mulmod(denominator, table.pow(-exponent), modulus)
+            else:
+                numerator = backend.mulmod(numerator, table.pow(exponent), modulus)
+        elif exponent == 1:
+            numerator = backend.mulmod(numerator, base, modulus)
+        elif exponent < 0:
+            interleaved.append((backend.invert(base, modulus), -exponent))
+        else:
+            interleaved.append((base, exponent))
+
+    # a single base gains nothing from interleaving, and the backend's powmod runs in C
+    if len(interleaved) == 1:
+        result = backend.mulmod(numerator, backend.powmod(interleaved[0][0], interleaved[0][1], modulus), modulus)
+    else:
+        result = backend.mulmod(numerator, straus(interleaved, modulus, window), modulus)
+    if denominator != 1:
+        result = backend.mulmod(result, backend.invert(denominator, modulus), modulus)
+
+    return result
+
+
+def products_equal(left, right, modulus):
+    """
+    check a verification equation prod(left) == prod(right) mod modulus,
+    each side a list of (base, exponent) pairs with non-negative exponents.
+
+    Table bases and plain factors (exponent 1) stay where they are. When both sides
+    have other bases to exponentiate, the side with fewer of them is moved across
+    (one inversion per base) so they all share a single interleaved exponentiation;
+    when at most one side has any, no inversion is worth it. Nor is a base that is
+    0 mod modulus moved, since it has no inverse: both sides are computed as they are.
+    """
+    def is_variable(pair):
+        base, exponent = pair
+        return exponent > 1 and fixedbase.get_table(base, modulus) is None
+
+    left_variable = [pair for pair in left if is_variable(pair)]
+    right_variable = [pair for pair in right if is_variable(pair)]
+
+    if left_variable and right_variable:
+        if len(left_variable) < len(right_variable):
+            left, right = right, left
+            left_variable, right_variable = right_variable, left_variable
+
+        if all(base % modulus != 0 for base, _ in right_variable):
+            moved = [(base, -exponent) for base, exponent in right_variable]
+            right = [pair for pair in right if not is_variable(pair)]
+            left = left + moved
+
+    return multi_powmod(left, modulus) == multi_powmod(right, modulus)
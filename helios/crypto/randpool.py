@@ -0,0 +1,167 @@
+"""
+Pools of precomputed encryption randomness
+
+Encrypting with a public key, or proving an encryption, starts with a random exponent x
+and the two powers g^x and y^x. None of them depend on the message, so they can be
+computed ahead of time: when a public key has a RandomnessPool, the encryption and
+proof code takes its (x, g^x, y^x) triples from the pool, and what is left to do online
+is mostly multiplications. That is useful wherever ballots are generated server-side,
+like load tests or fixtures.
+
+A pool is filled in the calling process with fill(), or kept filled by a background
+process with start(). Each triple is handed out once. When the pool is empty, or when
+a public key has no pool, take() computes a fresh triple.
+
+A forked child starts out without any pool: handing out the triples it inherited
+would reuse the parent's randomness, and reveal what it encrypted.
+"""
+
+import collections
+import multiprocessing
+import os
+import queue
+import threading
+
+from helios.crypto import fixedbase
+from helios.crypto.utils import random
+
+DEFAULT_POOL_SIZE = 1000
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def _reset_pools():
+    global _pools, _pools_lock, _pools_pid
+
+    # the filler processes and their queues belong to the parent, only forget them.
+    # A new lock too: another thread may have been holding the old one at fork time
+    _pools = {}
+    _pools_lock = threading.Lock()
+    _pools_pid = os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools)
+
+
+def _check_pid():
+    # in case of a fork that register_at_fork does not see
+    if _pools_pid != os.getpid():
+        _reset_pools()
+
+
+def _key(pk):
+    return (pk.p, pk.g, pk.y)
+
+
+def generate_triple(pk):
+    x = random.mpz_lt(pk.q)
+    return x, fixedbase.powmod(pk.g, x, pk.p), fixedbase.powmod(pk.y, x, pk.p)
+
+
+class RandomnessPool(object):
+    """
+    (x, g^x, y^x) triples for one public key
+    """
+
+    def __init__(self, pk, size=DEFAULT_POOL_SIZE):
+        self.pk = pk
+        self.size = size
+        self.triples = collections.deque()
+
+        # filled by the background process, if any
+        self.queue = None
+        self.process = None
+
+    def __len__(self):
+        return len(self.triples)
+
+    def fill(self):
+        """
+        compute triples in this process, until the pool is full
+        """
+        self.pk.precompute_tables()
+        while len(self.triples) < self.size:
+            self.triples.append(generate_triple(self.pk))
+
+    def start(self):
+        """
+        keep the pool filled from a background process, until stop()
+        """
+        if self.process is not None:
+            return
+
+        # daemonic processes, like prefork celery workers, cannot have children
+        if multiprocessing.current_process().daemon:
+            self.fill()
+            return
+
+        # before the fork, so that the background process inherits the tables
+        self.pk.precompute_tables()
+
+        context = multiprocessing.get_context('fork')
+        self.queue = context.Queue(self.size)
+        self.process = context.Process(target=self._produce, daemon=True)
+        self.process.start()
+
+    def _produce(self):
+        # runs in the background process, blocks while the queue is full
+        while True:
+            self.queue.put(generate_triple(self.pk))
+
+    def stop(self):
+        if self.process is None:
+            return
+
+        self.process.terminate()
+        self.process.join()
+        self.process = None
+        self.queue = None
+
+    def take(self):
+        try:
+            return self.triples.popleft()
+        except IndexError:
+            pass
+
+        if self.queue is not None:
+            try:
+                return self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+        return generate_triple(self.pk)
+
+
+def get_pool(pk, size=DEFAULT_POOL_SIZE):
+    """
+    the pool of pk, created if it does not exist yet
+    """
+    _check_pid()
+    with _pools_lock:
+        if _key(pk) not in _pools:
+            _pools[_key(pk)] = RandomnessPool(pk, size)
+        return _pools[_key(pk)]
+
+
+def remove_pool(pk):
+    _check_pid()
+    with _pools_lock:
+        pool = _pools.pop(_key(pk), None)
+
+    if pool is not None:
+        pool.stop()
+
+
+def take(pk):
+    """
+    a random exponent x with g^x and y^x, from the pool of pk if it has one
+    """
+    _check_pid()
+    pool = _pools.get(_key(pk))
+    if pool is None:
+        return generate_triple(pk)
+
+    return pool.take()
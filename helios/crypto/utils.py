@@ -2,22 +2,81 @@
 Crypto Utils
 """
 import base64
-import math
+import os
+import threading
 
 from Crypto.Hash import SHA256
 from Crypto.Random.random import StrongRandom
 
-random = StrongRandom()
+# bytes pulled from the OS at a time
+RANDOM_BLOCK_SIZE = 64 * 1024
+
+
+class RandomBuffer(object):
+    """
+    Random bytes from os.urandom, read a block at a time.
+
+    Reads are serialized with a lock, and a forked child drops the bytes
+    that it inherited, so that parent and child never hand out the same ones.
+    """
+
+    def __init__(self, block_size=RANDOM_BLOCK_SIZE):
+        self.block_size = block_size
+        self._reset()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # a new lock too: another thread may have been holding the old one at fork time
+        self.lock = threading.Lock()
+        self.buffer = b''
+        self.offset = 0
+        self.pid = os.getpid()
+
+    def read(self, n):
+        with self.lock:
+            # in case of a fork that register_at_fork does not see
+            if self.pid != os.getpid():
+                self.buffer, self.offset, self.pid = b'', 0, os.getpid()
+
+            if n > self.block_size:
+                return os.urandom(n)
+
+            if self.offset + n > len(self.buffer):
+                self.buffer = os.urandom(self.block_size)
+                self.offset = 0
+
+            result = self.buffer[self.offset:self.offset + n]
+            self.offset += n
+            return result
+
+
+random_buffer = RandomBuffer()
+
+random = StrongRandom(randfunc=random_buffer.read)
+
+
+def random_getrandbits(n_bits):
+    """
+    same as StrongRandom.getrandbits, without its layers
+    """
+    return int.from_bytes(random_buffer.read((n_bits + 7) // 8), 'big') & ((1 << n_bits) - 1)
 
 
 def random_mpz_lt(maximum, strong_random=random):
-    n_bits = int(math.floor(math.log(maximum, 2)))
+    """
+    uniformly random integer in [0, maximum), by rejection sampling
+    """
+    n_bits = (maximum - 1).bit_length()
+
     res = strong_random.getrandbits(n_bits)
     while res >= maximum:
         res = strong_random.getrandbits(n_bits)
     return res
 
 
+random.getrandbits = random_getrandbits
 random.mpz_lt = random_mpz_lt
 
 
@@ -42,11 +42,17 @@ def recursiveToDict(obj):
     else:
         return obj.toDict()
 
+# datatype string -> class, resolved once per process
+_classes = {}
+
 def get_class(datatype):
     # already done?
     if not isinstance(datatype, str):
         return datatype
 
+    if datatype in _classes:
+        return _classes[datatype]
+
     # parse datatype string "v31/Election" --> from v31 import Election
     parsed_datatype = datatype.split("/")
     
@@ -66,6 +72,7 @@ def get_class(datatype):
         raise Exception ("no module for %s" % datatype)    
 
     dynamic_cls.datatype = datatype
+    _classes[datatype] = dynamic_cls
         
     return dynamic_cls
         
@@ -0,0 +1,129 @@
+"""
+Compact datatypes for Helios
+
+The ballot and tally objects of the legacy datatypes, with big integers as base64
+big-endian bytes rather than decimal strings: a 2048-bit group element takes 344
+characters instead of about 617, and decoding it is linear in its length.
+Group elements are padded to 256 bytes and exponents to 32 bytes, so that with
+the standard 2048-bit group every value of a kind has the same width.
+
+Hashes of ballots are still computed over the legacy serialization:
+legacy_to_compact() and compact_to_legacy() convert between the two.
+"""
+
+import base64
+
+from helios.datatypes import LDObject, arrayOf, DictObject
+from helios.crypto import elgamal as crypto_elgamal
+from helios.workflows import homomorphic
+
+class CompactObject(LDObject):
+    WRAPPED_OBJ_CLASS = dict
+    USE_JSON_LD = False
+
+class BigInteger(LDObject):
+    """
+    a non-negative integer as base64 big-endian bytes, at least WIDTH bytes long
+    """
+    WRAPPED_OBJ_CLASS = int
+    WIDTH = 0
+
+    def toDict(self, complete=False):
+        value = self.wrapped_obj
+        width = max(self.WIDTH, (value.bit_length() + 7) // 8)
+        return base64.b64encode(value.to_bytes(width, 'big')).decode('ascii')
+
+    def loadDataFromDict(self, d):
+        self.wrapped_obj = int.from_bytes(base64.b64decode(d, validate=True), 'big')
+
+class GroupElement(BigInteger):
+    "an element mod p"
+    WIDTH = 256
+
+class Exponent(BigInteger):
+    "an exponent mod q, or a challenge"
+    WIDTH = 32
+
+class EGPublicKey(CompactObject):
+    WRAPPED_OBJ_CLASS = crypto_elgamal.PublicKey
+    FIELDS = ['y', 'p', 'g', 'q']
+    STRUCTURED_FIELDS = {
+        'y': 'compact/GroupElement',
+        'p': 'compact/GroupElement',
+        'q': 'compact/Exponent',
+        'g': 'compact/GroupElement'}
+
+class EGCiphertext(CompactObject):
+    WRAPPED_OBJ_CLASS = crypto_elgamal.Ciphertext
+    FIELDS = ['alpha','beta']
+    STRUCTURED_FIELDS = {
+        'alpha': 'compact/GroupElement',
+        'beta' : 'compact/GroupElement'}
+
+class EGZKProofCommitment(DictObject, CompactObject):
+    FIELDS = ['A', 'B']
+    STRUCTURED_FIELDS = {
+        'A' : 'compact/GroupElement',
+        'B' : 'compact/GroupElement'}
+
+class EGZKProof(CompactObject):
+    WRAPPED_OBJ_CLASS = crypto_elgamal.ZKProof
+    FIELDS = ['commitment', 'challenge', 'response']
+    STRUCTURED_FIELDS = {
+        'commitment': 'compact/EGZKProofCommitment',
+        'challenge' : 'compact/Exponent',
+        'response' : 'compact/Exponent'}
+
+class EGZKDisjunctiveProof(CompactObject):
+    WRAPPED_OBJ_CLASS = crypto_elgamal.ZKDisjunctiveProof
+    FIELDS = ['proofs']
+    STRUCTURED_FIELDS = {
+        'proofs': arrayOf('compact/EGZKProof')}
+
+    def loadDataFromDict(self, d):
+        "like legacy, only the array of proofs"
+        return super(EGZKDisjunctiveProof, self).loadDataFromDict({'proofs': d})
+
+    def toDict(self, complete = False):
+        return super(EGZKDisjunctiveProof, self).toDict(complete=complete)['proofs']
+
+class EncryptedAnswer(CompactObject):
+    WRAPPED_OBJ_CLASS = homomorphic.EncryptedAnswer
+    FIELDS = ['choices', 'individual_proofs', 'overall_proof']
+    STRUCTURED_FIELDS = {
+        'choices': arrayOf('compact/EGCiphertext'),
+        'individual_proofs': arrayOf('compact/EGZKDisjunctiveProof'),
+        'overall_proof' : 'compact/EGZKDisjunctiveProof'
+        }
+
+class EncryptedVote(CompactObject):
+    WRAPPED_OBJ_CLASS = homomorphic.EncryptedVote
+    FIELDS = ['answers', 'election_hash', 'election_uuid']
+    STRUCTURED_FIELDS = {
+        'answers' : arrayOf('compact/EncryptedAnswer')
+        }
+
+class Tally(CompactObject):
+    WRAPPED_OBJ_CLASS = homomorphic.Tally
+    FIELDS = ['tally', 'num_tallied']
+    STRUCTURED_FIELDS = {
+        'tally': arrayOf(arrayOf('compact/EGCiphertext'))}
+
+##
+## converters
+##
+
+def legacy_to_compact(d, name):
+    """
+    the compact form of d, the legacy serialization of a name object,
+    e.g. legacy_to_compact(vote_dict, 'EncryptedVote')
+    """
+    obj = LDObject.fromDict(d, type_hint='legacy/%s' % name).wrapped_obj
+    return LDObject.instantiate(obj, datatype='compact/%s' % name).toDict()
+
+def compact_to_legacy(d, name):
+    """
+    the legacy form of d, the compact serialization of a name object
+    """
+    obj = LDObject.fromDict(d, type_hint='compact/%s' % name).wrapped_obj
+    return LDObject.instantiate(obj, datatype='legacy/%s' % name).toDict()
@@ -4,6 +4,36 @@ core data types
 
 from helios.datatypes import LDObject
 
+class DecimalInt(int):
+    """
+    An int that keeps the decimal string it was parsed from, so that str() hands
+    the string back instead of converting again, which is quadratic in the number
+    of digits. Arithmetic on it gives plain ints.
+    """
+
+    def __new__(cls, decimal):
+        value = int.__new__(cls, decimal)
+        value.decimal = decimal
+        return value
+
+    def __getnewargs__(self):
+        return (self.decimal,)
+
+    def __str__(self):
+        return self.decimal
+
+
+def is_canonical_decimal(s):
+    """
+    whether s is exactly what str() gives for int(s), if int(s) parses at all:
+    no sign, surrounding whitespace, underscores, leading zeros or non-ASCII digits
+    """
+    if s == '0':
+        return True
+
+    return s != '' and s.isascii() and '_' not in s and s[0] in '123456789' and s[-1] in '0123456789'
+
+
 class BigInteger(LDObject):
     """
     A big integer is an integer serialized as a string.
@@ -19,7 +49,11 @@ class BigInteger(LDObject):
 
     def loadDataFromDict(self, d):
         "take a string and cast it to an int -- which is a big int too"
-        self.wrapped_obj = int(d)
+        # keep the wire string, for hashing and serializing again
+        if isinstance(d, str) and is_canonical_decimal(d):
+            self.wrapped_obj = DecimalInt(d)
+        else:
+            self.wrapped_obj = int(d)
 
 class Timestamp(LDObject):
     def toDict(self, complete=False):
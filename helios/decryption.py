@@ -0,0 +1,94 @@
+"""
+Parallel partial decryption of the tally by the Helios trustee
+
+Each cell of the tally (an answer to a question) needs an exponentiation and a
+Chaum-Pedersen proof from the trustee's secret key, and ballots with many questions
+have hundreds of cells. The DecryptionEngine cuts the cells in chunks that a pool of
+worker processes decrypts, and checkpoints the decrypted cells on the trustee as
+chunks complete: when a decryption is interrupted, running it again only decrypts
+the cells that are missing. The checkpoint records the hash of the tally it was
+computed from, and is discarded if the tally has changed since.
+"""
+
+from django.conf import settings
+
+from .crypto import fixedbase
+from .crypto.utils import hash_b64
+from .datatypes import LDObject
+from .pool import WorkerPool
+
+# tally cells decrypted together by a worker, and checkpointed together
+DEFAULT_CHUNK_SIZE = 10
+
+
+def decrypt_cells(sk, ciphertexts):
+    """
+    runs in a worker: the decryption factor and proof of each ciphertext
+    """
+    return [sk.decryption_factor_and_proof(ciphertext) for ciphertext in ciphertexts]
+
+
+def cell_key(question_num, answer_num):
+    return "%s,%s" % (question_num, answer_num)
+
+
+class DecryptionEngine(WorkerPool):
+    """
+    Decrypts the tally for the Helios trustee on a pool of worker processes.
+    """
+
+    def __init__(self, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        super(DecryptionEngine, self).__init__(workers or settings.HELIOS_DECRYPT_WORKERS)
+        self.chunk_size = chunk_size
+
+    def decrypt(self, trustee, tally):
+        """
+        compute and store the trustee's decryption factors and proofs of the tally.
+        Cells already in the trustee's checkpoint of this same tally are not decrypted again.
+        """
+        sk = trustee.secret_key
+        tally_hash = hash_b64(tally.toJSON())
+
+        checkpoint = trustee.decryption_checkpoint
+        if not checkpoint or checkpoint.get('tally_hash') != tally_hash:
+            checkpoint = {'tally_hash': tally_hash, 'cells': {}}
+        decrypted = checkpoint['cells']
+
+        cells = [(question_num, answer_num)
+                 for question_num, question_tally in enumerate(tally.tally)
+                 for answer_num in range(len(question_tally))
+                 if cell_key(question_num, answer_num) not in decrypted]
+        chunks = [cells[start:start + self.chunk_size] for start in range(0, len(cells), self.chunk_size)]
+
+        # every decryption proof commits to a power of g, before the pool forks
+        fixedbase.precompute(sk.pk.g, sk.pk.p, sk.pk.q.bit_length())
+
+        args_list = [(sk, [tally.tally[question_num][answer_num] for question_num, answer_num in chunk])
+                     for chunk in chunks]
+
+        for chunk_num, results in self.imap_unordered(decrypt_cells, args_list):
+            for (question_num, answer_num), (dec_factor, proof) in zip(chunks[chunk_num], results):
+                proof_dict = LDObject.instantiate(proof, datatype='legacy/EGZKProof').toDict()
+                decrypted[cell_key(question_num, answer_num)] = [str(dec_factor), proof_dict]
+
+            trustee.decryption_checkpoint = checkpoint
+            trustee.save(update_fields=['decryption_checkpoint'])
+
+        decryption_factors = []
+        decryption_proofs = []
+        for question_num, question_tally in enumerate(tally.tally):
+            question_factors = []
+            question_proofs = []
+
+            for answer_num in range(len(question_tally)):
+                dec_factor, proof_dict = decrypted[cell_key(question_num, answer_num)]
+                question_factors.append(int(dec_factor))
+                question_proofs.append(LDObject.fromDict(proof_dict, type_hint='legacy/EGZKProof').wrapped_obj)
+
+            decryption_factors.append(question_factors)
+            decryption_proofs.append(question_proofs)
+
+        trustee.decryption_factors = decryption_factors
+        trustee.decryption_proofs = decryption_proofs
+        trustee.decryption_checkpoint = None
+        trustee.save()
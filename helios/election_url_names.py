@@ -64,6 +64,7 @@ ELECTION_VOTER_DELETE="election@voter@delete"
 ELECTION_VOTERS_CLEAR="election@voters@clear"
 
 ELECTION_BALLOTS_LIST="election@ballots@list"
+ELECTION_BALLOTS_CIPHERTEXTS="election@ballots@ciphertexts"
 ELECTION_BALLOTS_VOTER="election@ballots@voter"
 ELECTION_BALLOTS_VOTER_LAST="election@ballots@voter@last"
 
@@ -102,6 +102,7 @@ urlpatterns = [
     
     # ballots
     path('/ballots/', views.ballot_list, name=names.ELECTION_BALLOTS_LIST),
+    path('/ballots/ciphertexts', views.ballot_ciphertexts_list, name=names.ELECTION_BALLOTS_CIPHERTEXTS),
     path('/ballots/<str:voter_uuid>/all', views.voter_votes, name=names.ELECTION_BALLOTS_VOTER),
     path('/ballots/<str:voter_uuid>/last', views.voter_last_vote, name=names.ELECTION_BALLOTS_VOTER_LAST),
 
@@ -0,0 +1,61 @@
+"""
+run the micro-benchmarks of helios.benchmarks, optionally saving the results
+as JSON and comparing them with those of an earlier run
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from helios import benchmarks
+from helios.views import ELGAMAL_PARAMS
+
+
+class Command(BaseCommand):
+    help = 'measure the cost of the crypto primitives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help='benchmarks to run (default: all of them: %s)' % ', '.join(benchmarks.BENCHMARKS))
+        parser.add_argument('--repeat', type=int, default=benchmarks.DEFAULT_REPEAT,
+                            help='rounds per benchmark (default: %s)' % benchmarks.DEFAULT_REPEAT)
+        parser.add_argument('--min-time', type=float, default=benchmarks.DEFAULT_MIN_TIME,
+                            help='shortest round, in seconds (default: %s)' % benchmarks.DEFAULT_MIN_TIME)
+        parser.add_argument('--output', default=None,
+                            help='save the results to this JSON file')
+        parser.add_argument('--compare', default=None,
+                            help='JSON file of an earlier run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.1,
+                            help='slowdown of the median that counts as a regression (default: 0.1, i.e. 10%%)')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        try:
+            results = benchmarks.run(ELGAMAL_PARAMS, names=options['names'],
+                                     repeat=options['repeat'], min_time=options['min_time'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for name, result in results['results'].items():
+            self.stdout.write("%-40s %12.2f us  (min %.2f, stdev %.2f)" % (
+                name, result['median'] * 1e6, result['min'] * 1e6, result['stdev'] * 1e6))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+            regressions = []
+            for name, baseline_median, median, ratio, regressed in benchmarks.compare(results, baseline, options['threshold']):
+                self.stdout.write("%-40s %12.2f us -> %10.2f us  x%.2f%s" % (
+                    name, baseline_median * 1e6, median * 1e6, ratio, '  REGRESSION' if regressed else ''))
+                if regressed:
+                    regressions.append(name)
+
+            if regressions:
+                raise CommandError("regressions: %s" % ", ".join(regressions))
@@ -0,0 +1,38 @@
+"""
+precompute the discrete log table of the instance's group generator,
+shared by every process that decrypts a tally (see helios.crypto.dlogfile)
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from helios.crypto import dlogfile
+from helios.views import ELGAMAL_PARAMS
+
+DEFAULT_BOUND = 1000000
+
+
+class Command(BaseCommand):
+    help = 'precompute the table of discrete logs used to decrypt tallies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bound', type=int, default=DEFAULT_BOUND,
+                            help='largest discrete log in the table, at least the number of ballots in any election (default: %s)' % DEFAULT_BOUND)
+        parser.add_argument('--path', default=None,
+                            help='where to write the table (default: the HELIOS_DLOG_TABLE setting)')
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.HELIOS_DLOG_TABLE
+        if not path:
+            raise CommandError("no path given and HELIOS_DLOG_TABLE is not set")
+
+        if not 0 <= options['bound'] <= dlogfile.MAX_BOUND:
+            raise CommandError("bound must be between 0 and %s" % dlogfile.MAX_BOUND)
+
+        start = time.time()
+        table = dlogfile.DLogFileTable.build(path, ELGAMAL_PARAMS.g, ELGAMAL_PARAMS.p, options['bound'])
+
+        self.stdout.write("wrote discrete logs up to %s to %s (%s slots) in %.1fs" % (
+            table.bound, path, table.num_slots, time.time() - start))
@@ -0,0 +1,21 @@
+"""
+check that the fingerprints stored when elections were frozen still match the elections
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from helios.models import Election
+
+
+class Command(BaseCommand):
+    help = 'recompute the fingerprints of frozen elections and compare them with the stored ones'
+
+    def handle(self, *args, **options):
+        mismatches = []
+        for election in Election.objects.exclude(election_hash=None):
+            if not election.check_hash():
+                self.stdout.write("%s: stored %s, computed %s" % (election.short_name, election.election_hash, election.compute_hash()))
+                mismatches.append(election.short_name)
+
+        if mismatches:
+            raise CommandError("%d elections do not match their fingerprint" % len(mismatches))
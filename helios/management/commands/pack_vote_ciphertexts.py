@@ -0,0 +1,18 @@
+"""
+pack the choice ciphertexts of the votes stored before votes had packed copies,
+so that tallies and the ballot ciphertexts list don't need to go through the votes' JSON
+"""
+
+from django.core.management.base import BaseCommand
+
+from helios.models import Election
+
+
+class Command(BaseCommand):
+    help = 'pack the ciphertexts of votes stored without a packed copy'
+
+    def handle(self, *args, **options):
+        for election in Election.objects.exclude(frozen_at=None):
+            num_packed = election.pack_cast_vote_ciphertexts()
+            if num_packed:
+                self.stdout.write("%s: packed %d votes" % (election.short_name, num_packed))
@@ -1,36 +1,151 @@
 """
 verify cast votes that have not yet been verified
 
+Worker processes drain the pending cast votes: each one claims a batch of votes that
+no other worker holds (SELECT ... FOR UPDATE SKIP LOCKED), verifies it and stores the
+results in the same transaction, until there are none left. Interrupting the command
+lets the workers finish the batch in hand, so it can be run again to resume.
+
+A vote whose verification raises is logged and left pending, and the command fails
+once the others are verified, as it does when a worker dies.
+
 Ben Adida
 ben@adida.net
 2010-05-22
 """
 
-from django.core.management.base import BaseCommand
+import multiprocessing
+import os
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from helios.models import CastVote, Election
+
+
+def drain(stop, counts, election_id, batch_size, on_batch=None):
+    """
+    verify batches of pending cast votes until there are none left or stop is set.
+    counts[0], counts[1] and counts[2] accumulate the numbers of votes verified,
+    invalidated, and whose verification raised.
+    """
+    election = Election.objects.get(id=election_id) if election_id else None
+
+    # votes whose verification raised, not to be claimed again
+    failed_ids = []
 
-from helios.models import CastVote
+    while not stop.is_set():
+        cast_votes, results = CastVote.verify_pending_batch(batch_size, election, failed_ids)
+        if not cast_votes:
+            break
 
+        failed_ids.extend(cast_vote.id for cast_vote, result in zip(cast_votes, results) if result is None)
+
+        with counts.get_lock():
+            counts[0] += results.count(True)
+            counts[1] += results.count(False)
+            counts[2] += results.count(None)
+
+        if on_batch:
+            on_batch()
+
+
+def drain_in_worker(stop, counts, election_id, batch_size):
+    # the parent decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    try:
+        drain(stop, counts, election_id, batch_size)
+    finally:
+        connections.close_all()
 
-def get_cast_vote_to_verify():
-    # fixme: add "select for update" functionality here
-    votes = CastVote.objects.filter(verified_at=None, invalidated_at=None).order_by('-cast_at')
-    if len(votes) > 0:
-        return votes[0]
-    else:
-        return None
 
 class Command(BaseCommand):
     args = ''
     help = 'verify votes that were cast'
-    
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='number of worker processes (default: HELIOS_VERIFY_WORKERS, or one per CPU)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='cast votes claimed at a time by a worker (default: HELIOS_VERIFY_BATCH_SIZE)')
+        parser.add_argument('--election', default=None,
+                            help='only verify the votes of the election with this UUID')
+        parser.add_argument('--report-every', type=float, default=10,
+                            help='seconds between progress reports (default: 10)')
+
     def handle(self, *args, **options):
-        while True:
-            cast_vote = get_cast_vote_to_verify()
-            if not cast_vote:
-                break
+        workers = options['workers'] or settings.HELIOS_VERIFY_WORKERS or os.cpu_count() or 1
+        batch_size = options['batch_size'] or settings.HELIOS_VERIFY_BATCH_SIZE
+
+        self.election = None
+        if options['election']:
+            self.election = Election.get_by_uuid(options['election'])
+            if not self.election:
+                raise CommandError("no election with UUID %s" % options['election'])
+        election_id = self.election.id if self.election else None
+
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        self.counts = context.Array('l', 3)
+        self.started_at = self.reported_at = time.time()
+        self.report_every = options['report_every']
+
+        # on the first interruption, workers finish the batch in hand
+        def interrupt(signum, frame):
+            if not stop.is_set():
+                self.stdout.write("stopping after the current batches")
+            stop.set()
+
+        previous_handlers = [(signum, signal.signal(signum, interrupt)) for signum in (signal.SIGINT, signal.SIGTERM)]
+        failed_workers = []
+
+        try:
+            if workers == 1:
+                drain(stop, self.counts, election_id, batch_size, on_batch=self.report_if_due)
+            else:
+                # each worker opens its own database connections
+                connections.close_all()
+
+                processes = [context.Process(target=drain_in_worker, args=(stop, self.counts, election_id, batch_size))
+                             for _ in range(workers)]
+                for process in processes:
+                    process.start()
+
+                for process in processes:
+                    while process.is_alive():
+                        process.join(timeout=1)
+                        self.report_if_due()
+
+                # the others take over the votes of a worker that died, unless they all did
+                failed_workers = [process for process in processes if process.exitcode != 0]
+        finally:
+            for signum, handler in previous_handlers:
+                signal.signal(signum, handler)
+
+        self.report()
+
+        if failed_workers:
+            raise CommandError("%d of the %d workers failed, see their tracebacks" % (len(failed_workers), workers))
+        if self.counts[2]:
+            raise CommandError("%d cast votes could not be verified and are still pending, see the log" % self.counts[2])
+
+    def report_if_due(self):
+        if time.time() - self.reported_at >= self.report_every:
+            self.report()
+
+    def report(self):
+        self.reported_at = time.time()
+        elapsed = self.reported_at - self.started_at
 
-            cast_vote.verify_and_store()
+        verified, invalidated, failed = self.counts[0], self.counts[1], self.counts[2]
+        rate = (verified + invalidated) / elapsed if elapsed else 0
+        pending = CastVote.pending(self.election).count()
 
-        # once broken out of the while loop, quit and wait for next invocation
-        # this happens when there are no votes left to verify
-            
+        eta = "%ds" % (pending / rate) if rate else "unknown"
+        self.stdout.write("%d verified, %d invalid, %d failed, %.1f votes/s, %d pending, ETA %s"
+                          % (verified, invalidated, failed, rate, pending, eta))
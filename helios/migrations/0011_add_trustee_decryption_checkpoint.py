@@ -0,0 +1,18 @@
+from django.db import migrations
+
+import helios_auth.jsonfield
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('helios', '0010_add_query_indexes'),
+  ]
+
+  operations = [
+    migrations.AddField(
+      model_name='trustee',
+      name='decryption_checkpoint',
+      field=helios_auth.jsonfield.JSONField(null=True),
+    ),
+  ]
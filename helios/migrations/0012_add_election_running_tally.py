@@ -0,0 +1,18 @@
+from django.db import migrations
+
+import helios.datatypes.djangofield
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('helios', '0011_add_trustee_decryption_checkpoint'),
+  ]
+
+  operations = [
+    migrations.AddField(
+      model_name='election',
+      name='running_tally',
+      field=helios.datatypes.djangofield.LDObjectField(null=True),
+    ),
+  ]
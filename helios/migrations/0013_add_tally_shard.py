@@ -0,0 +1,28 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+import helios.datatypes.djangofield
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('helios', '0012_add_election_running_tally'),
+  ]
+
+  operations = [
+    migrations.CreateModel(
+      name='TallyShard',
+      fields=[
+        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+        ('first_voter_id', models.IntegerField()),
+        ('last_voter_id', models.IntegerField()),
+        ('tally', helios.datatypes.djangofield.LDObjectField(null=True)),
+        ('computed_at', models.DateTimeField(null=True)),
+        ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='helios.election')),
+      ],
+      options={
+        'unique_together': {('election', 'first_voter_id')},
+      },
+    ),
+  ]
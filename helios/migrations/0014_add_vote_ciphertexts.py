@@ -0,0 +1,21 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('helios', '0013_add_tally_shard'),
+  ]
+
+  operations = [
+    migrations.CreateModel(
+      name='VoteCiphertexts',
+      fields=[
+        ('voter', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='vote_ciphertexts', serialize=False, to='helios.voter')),
+        ('vote_hash', models.CharField(max_length=100)),
+        ('ciphertexts', models.BinaryField()),
+        ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='helios.election')),
+      ],
+    ),
+  ]
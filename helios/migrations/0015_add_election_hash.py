@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('helios', '0014_add_vote_ciphertexts'),
+  ]
+
+  operations = [
+    migrations.AddField(
+      model_name='election',
+      name='election_hash',
+      field=models.CharField(max_length=100, null=True),
+    ),
+  ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('helios', '0015_add_election_hash'),
+  ]
+
+  operations = [
+    migrations.AddField(
+      model_name='election',
+      name='running_tally_digest',
+      field=models.CharField(max_length=100, null=True),
+    ),
+  ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('helios', '0016_add_election_running_tally_digest'),
+  ]
+
+  operations = [
+    migrations.AddField(
+      model_name='tallyshard',
+      name='votes_digest',
+      field=models.CharField(max_length=100, null=True),
+    ),
+  ]
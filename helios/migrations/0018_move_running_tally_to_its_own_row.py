@@ -0,0 +1,32 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+import helios.datatypes.djangofield
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('helios', '0017_add_tallyshard_votes_digest'),
+  ]
+
+  # the running tallies are not copied: an election without one starts it
+  # from scratch the next time a vote is stored
+  operations = [
+    migrations.CreateModel(
+      name='RunningTally',
+      fields=[
+        ('election', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='helios.election')),
+        ('tally', helios.datatypes.djangofield.LDObjectField()),
+        ('votes_digest', models.CharField(max_length=100)),
+      ],
+    ),
+    migrations.RemoveField(
+      model_name='election',
+      name='running_tally',
+    ),
+    migrations.RemoveField(
+      model_name='election',
+      name='running_tally_digest',
+    ),
+  ]
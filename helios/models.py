@@ -9,11 +9,14 @@ Ben Adida
 import copy
 import csv
 import datetime
+import hashlib
+import logging
 import uuid
 
 import bleach
 from django.conf import settings
 from django.db import models, transaction
+from django.db.models.functions import Cast
 from validate_email import validate_email
 
 from helios import datatypes
@@ -138,6 +141,9 @@ class Election(HeliosModel):
   # the hash of all voters (stored for large numbers)
   voters_hash = models.CharField(max_length=100, null=True)
 
+  # the hash of the election itself, stored when it is frozen
+  election_hash = models.CharField(max_length=100, null=True)
+
   # encrypted tally, each a JSON string
   # used only for homomorphic tallies
   encrypted_tally = LDObjectField(type_hint = 'legacy/Tally',
@@ -215,6 +221,32 @@ class Election(HeliosModel):
 
     return utils.one_val_raw_sql("select max(cast(substr(alias, 2) as integer)) from " + Voter._meta.db_table + " where election_id = %s", [self.id]) or 0
 
+  @property
+  def hash(self):
+    """
+    the election's fingerprint, which every ballot refers to. Frozen elections serve the
+    one stored when they were frozen, rather than hashing the whole election again.
+    """
+    if self.election_hash:
+      return self.election_hash
+
+    # elections frozen before the hash was stored get it now
+    if self.frozen_at:
+      self.election_hash = self.compute_hash()
+      Election.objects.filter(id=self.id).update(election_hash=self.election_hash)
+      return self.election_hash
+
+    return self.compute_hash()
+
+  def compute_hash(self):
+    return self.ld_object.hash
+
+  def check_hash(self):
+    """
+    does the stored fingerprint still match the election?
+    """
+    return self.election_hash is None or self.election_hash == self.compute_hash()
+
   @property
   def encrypted_tally_hash(self):
     if not self.encrypted_tally:
@@ -485,15 +517,188 @@ class Election(HeliosModel):
 
   def compute_tally(self):
     """
-    tally the election, assuming votes already verified
+    tally the election, assuming votes already verified.
+    This is a snapshot of the running tally, unless it is missing votes.
     """
-    tally = self.init_tally()
-    for voter in self.voter_set.exclude(vote=None):
-      tally.add_vote(voter.vote, verify_p=False)
+    tally = self.get_running_tally()
+    if tally is None:
+      tally = self.tally_cast_votes()
+
+    self.store_encrypted_tally(tally)
 
+  def store_encrypted_tally(self, tally):
+    """
+    replace the encrypted tally. A decryption of the previous one that was
+    interrupted cannot be resumed, so the trustees' checkpoints are dropped.
+    """
     self.encrypted_tally = tally
     self.save()
 
+    self.trustee_set.exclude(decryption_checkpoint=None).update(decryption_checkpoint=None)
+
+  def get_running_tally(self):
+    """
+    the running tally, read from its own row, if it counts the voters' last votes and those only.
+    A count alone would not notice a lost recast, hence the digest of the votes.
+    """
+    running_tally = RunningTally.objects.filter(election_id = self.id).first()
+    if running_tally is None:
+      return None
+
+    voters = self.voter_set.exclude(vote=None)
+    if running_tally.tally.num_tallied != voters.count() or int(running_tally.votes_digest, 16) != Voter.votes_digest(voters):
+      return None
+
+    running_tally.tally.init_election(self)
+    return running_tally.tally
+
+  @property
+  def running_tally_complete(self):
+    return self.get_running_tally() is not None
+
+  def combine_tally_shards(self):
+    """
+    tally the election as the product of the partial tallies of its shards, which are then deleted.
+    Returns False, having deleted the shards, if they no longer count the voters' last votes:
+    votes were stored since, and the shards must be made again.
+    """
+    shards = list(self.tallyshard_set.order_by('first_voter_id'))
+
+    tally = self.init_tally()
+    votes_digest = 0
+    for shard in shards:
+      if shard.tally is None:
+        raise Exception("tally shard %s has not been computed" % shard.id)
+      tally.add_tally(shard.tally)
+      votes_digest = (votes_digest + int(shard.votes_digest, 16)) % VOTES_DIGEST_MODULUS
+
+    if votes_digest != Voter.votes_digest(self.voter_set.exclude(vote=None)):
+      self.tallyshard_set.all().delete()
+      return False
+
+    self.store_encrypted_tally(tally)
+
+    self.tallyshard_set.all().delete()
+    return True
+
+  def tally_cast_votes(self):
+    """
+    tally the voters' last cast votes from scratch
+    """
+    tally = self.init_tally()
+    tally.add_ciphertexts(self.cast_vote_ciphertexts(self.voter_set.all()))
+    return tally
+
+  def pack_vote_ciphertexts(self, ciphertexts):
+    from helios.workflows import homomorphic
+    return homomorphic.pack_ciphertexts(ciphertexts, homomorphic.ciphertext_width(self.public_key))
+
+  def unpack_vote_ciphertexts(self, packed):
+    from helios.workflows import homomorphic
+    shape = [len(question['answers']) for question in self.questions]
+    return homomorphic.unpack_ciphertexts(bytes(packed), shape, homomorphic.ciphertext_width(self.public_key))
+
+  def pack_cast_vote_ciphertexts(self, chunk_size=1000):
+    """
+    pack the ciphertexts of the votes stored before there were packed copies,
+    returns the number of votes packed
+    """
+    from helios.workflows import homomorphic
+
+    num_packed = 0
+    with transaction.atomic():
+      # no votes are stored meanwhile
+      Election.objects.select_for_update().get(id=self.id)
+
+      voters = self.voter_set.exclude(vote=None).filter(vote_ciphertexts = None)
+      rows = voters.annotate(raw_vote=Cast('vote', models.TextField())).values_list('id', 'vote_hash', 'raw_vote')
+
+      packed = []
+      for voter_id, vote_hash, raw_vote in rows.iterator(chunk_size=chunk_size):
+        packed.append(VoteCiphertexts(voter_id = voter_id, election = self, vote_hash = vote_hash,
+                                      ciphertexts = self.pack_vote_ciphertexts(homomorphic.vote_ciphertexts(raw_vote))))
+        if len(packed) == chunk_size:
+          VoteCiphertexts.objects.bulk_create(packed)
+          num_packed += len(packed)
+          packed = []
+
+      VoteCiphertexts.objects.bulk_create(packed)
+      num_packed += len(packed)
+
+    return num_packed
+
+  def cast_vote_ciphertexts(self, voters, chunk_size=1000):
+    """
+    the choice ciphertexts of the last votes of the voters who voted among voters,
+    streamed chunk by chunk from their packed copies
+    """
+    from helios.workflows import homomorphic
+
+    packed_ciphertexts = VoteCiphertexts.objects.filter(voter__in = voters).values_list('ciphertexts', flat=True)
+    for packed in packed_ciphertexts.iterator(chunk_size=chunk_size):
+      yield self.unpack_vote_ciphertexts(packed)
+
+    # votes stored before there were packed copies
+    for raw_vote in Voter.raw_votes(voters.filter(vote_ciphertexts = None), chunk_size=chunk_size):
+      yield homomorphic.vote_ciphertexts(raw_vote)
+
+  def check_running_tally(self):
+    """
+    does the running tally match a tally of the cast votes from scratch?
+    """
+    running_tally = RunningTally.objects.filter(election_id = self.id).first()
+    tally = self.tally_cast_votes()
+
+    if running_tally is None:
+      return tally.num_tallied == 0
+    running_tally = running_tally.tally
+
+    # a cell that no vote was added to is 0, the same as an encryption of 0 with no randomness
+    def cells(t):
+      return [(1, 1) if isinstance(ciphertext, int) else (ciphertext.alpha, ciphertext.beta) for question_tally in t.tally for ciphertext in question_tally]
+
+    return running_tally.num_tallied == tally.num_tallied and cells(running_tally) == cells(tally)
+
+  def init_tally_delta(self):
+    """
+    an empty change to the running tally, for the votes stored by a transaction to be added
+    to and removed from, before add_to_running_tally() applies it at the end of the transaction
+    """
+    tally_delta = self.init_tally()
+    tally_delta.votes_digest = 0
+    return tally_delta
+
+  def add_to_running_tally(self, tally_delta):
+    """
+    apply the change to the running tally of the votes stored by the current transaction.
+    The running tally's row is locked from here to the end of the transaction, once per
+    batch of votes rather than once per vote: storing a vote locks the voter's row instead.
+    This is the only writer of the election's RunningTally.
+    """
+    with transaction.atomic():
+      running_tally = RunningTally.objects.select_for_update().filter(election_id = self.id).first()
+
+      # only one transaction creates it
+      if running_tally is None:
+        Election.objects.select_for_update().get(id=self.id)
+        running_tally = RunningTally.objects.select_for_update().filter(election_id = self.id).first()
+
+      if running_tally is None:
+        # elections that had votes before there was a running tally start from scratch,
+        # which counts the votes stored by this transaction already
+        running_tally = RunningTally(election = self)
+        tally = self.tally_cast_votes()
+        votes_digest = Voter.votes_digest(self.voter_set.exclude(vote=None))
+      else:
+        tally = running_tally.tally
+        tally.init_election(self)
+        tally.add_tally(tally_delta)
+        votes_digest = (int(running_tally.votes_digest, 16) + tally_delta.votes_digest) % VOTES_DIGEST_MODULUS
+
+      running_tally.tally = tally
+      running_tally.votes_digest = '%x' % votes_digest
+      running_tally.save()
+
   def ready_for_decryption(self):
     return self.encrypted_tally is not None
 
@@ -617,6 +822,9 @@ class Election(HeliosModel):
 
     self.public_key = combined_pk
 
+    # nothing in the election's fingerprint changes from now on
+    self.election_hash = self.compute_hash()
+
     # log it
     self.append_log(ElectionLog.FROZEN)
 
@@ -673,16 +881,39 @@ class Election(HeliosModel):
   def has_helios_trustee(self):
     return self.get_helios_trustee() is not None
 
-  def helios_trustee_decrypt(self):
+  def helios_trustee_decrypt(self, engine=None):
+    """
+    decrypt the Helios trustee's share of the tally, resuming from its checkpoint if any
+    """
+    from helios.decryption import DecryptionEngine
+
     tally = self.encrypted_tally
     tally.init_election(self)
 
     trustee = self.get_helios_trustee()
-    factors, proof = tally.decryption_factors_and_proofs(trustee.secret_key)
 
-    trustee.decryption_factors = factors
-    trustee.decryption_proofs = proof
-    trustee.save()
+    if engine:
+      engine.decrypt(trustee, tally)
+    else:
+      with DecryptionEngine() as engine:
+        engine.decrypt(trustee, tally)
+
+  @property
+  def helios_trustee_decryption_progress(self):
+    """
+    while the Helios trustee decrypts the tally, a dictionary of the number of tally cells
+    decrypted so far and of the total number of cells. None otherwise.
+    """
+    if not self.encrypted_tally:
+      return None
+
+    trustee = self.get_helios_trustee()
+    if not trustee or trustee.decryption_factors:
+      return None
+
+    checkpoint = trustee.decryption_checkpoint or {}
+    return {'done': len(checkpoint.get('cells', {})),
+            'total': sum(len(q['answers']) for q in self.questions)}
 
   def append_log(self, text):
     item = ElectionLog(election = self, log=text, at=datetime.datetime.utcnow())
@@ -928,6 +1159,9 @@ class VoterFile(models.Model):
 
     return successful_voters
 
+# Voter.votes_digest() is a sum modulo this
+VOTES_DIGEST_MODULUS = 2 ** 256
+
 class Voter(HeliosModel):
   election = models.ForeignKey(Election, on_delete=models.CASCADE)
 
@@ -1120,16 +1354,94 @@ class Voter(HeliosModel):
 
     self.voter_password = utils.random_string(length, alphabet='abcdefghjkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789')
 
-  def store_vote(self, cast_vote):
+  def store_vote(self, cast_vote, tally_delta=None):
+    """
+    store the cast vote as the voter's last one, and count it in the election's running
+    tally instead of the voter's previous vote. Callers that store many votes at once
+    pass a tally_delta from election.init_tally_delta(), and apply it with
+    election.add_to_running_tally() in the same transaction once they are done.
+    """
+    if tally_delta is None:
+      with transaction.atomic():
+        tally_delta = self.election.init_tally_delta()
+        self.store_vote(cast_vote, tally_delta)
+        self.election.add_to_running_tally(tally_delta)
+      return
+
+    # another process may have stored a vote for this voter since it was loaded,
+    # and it must wait for this one, or both would take the previous vote out of the tally
+    self.vote_hash, self.cast_at = Voter.objects.select_for_update().filter(id=self.id).values_list('vote_hash', 'cast_at').get()
+
     # only store the vote if it's cast later than the current one
     if self.cast_at and cast_vote.cast_at < self.cast_at:
       return
 
+    if self.vote_hash:
+      tally_delta.remove_ciphertexts(self.last_vote_ciphertexts())
+      tally_delta.votes_digest = (tally_delta.votes_digest - self.vote_digest(self.id, self.vote_hash)) % VOTES_DIGEST_MODULUS
+    tally_delta.add_vote(cast_vote.vote, verify_p=False)
+    tally_delta.votes_digest = (tally_delta.votes_digest + self.vote_digest(self.id, cast_vote.vote_hash)) % VOTES_DIGEST_MODULUS
+
     self.vote = cast_vote.vote
     self.vote_hash = cast_vote.vote_hash
     self.cast_at = cast_vote.cast_at
     self.save()
 
+    VoteCiphertexts.objects.update_or_create(voter = self, defaults = {
+      'election': self.election,
+      'vote_hash': self.vote_hash,
+      'ciphertexts': self.election.pack_vote_ciphertexts(self.vote.choice_ciphertexts())})
+
+  def last_vote_ciphertexts(self):
+    """
+    the choice ciphertexts of the voter's last vote, from their packed copy unless
+    the vote was stored before there were packed copies
+    """
+    packed = VoteCiphertexts.objects.filter(voter = self, vote_hash = self.vote_hash).values_list('ciphertexts', flat=True).first()
+    if packed is None:
+      return Voter.objects.get(id=self.id).vote.choice_ciphertexts()
+
+    return self.election.unpack_vote_ciphertexts(packed)
+
+  def delete(self, *args, **kwargs):
+    # the voter's vote no longer counts
+    if self.vote_hash:
+      with transaction.atomic():
+        tally_delta = self.election.init_tally_delta()
+        self.vote_hash = Voter.objects.select_for_update().filter(id=self.id).values_list('vote_hash', flat=True).get()
+        tally_delta.remove_ciphertexts(self.last_vote_ciphertexts())
+        tally_delta.votes_digest = (tally_delta.votes_digest - self.vote_digest(self.id, self.vote_hash)) % VOTES_DIGEST_MODULUS
+
+        deleted = super(Voter, self).delete(*args, **kwargs)
+        self.election.add_to_running_tally(tally_delta)
+        return deleted
+
+    return super(Voter, self).delete(*args, **kwargs)
+
+  @staticmethod
+  def vote_digest(voter_id, vote_hash):
+    return int(hashlib.sha256(("%s/%s" % (voter_id, vote_hash)).encode('utf-8')).hexdigest(), 16)
+
+  @classmethod
+  def votes_digest(cls, voters):
+    """
+    digest of the voters' last votes: the sum of the digests of each voter's vote,
+    so that votes can be added to it and removed from it one at a time
+    """
+    digest = 0
+    for voter_id, vote_hash in voters.values_list('id', 'vote_hash').iterator():
+      digest = (digest + cls.vote_digest(voter_id, vote_hash)) % VOTES_DIGEST_MODULUS
+    return digest
+
+  @classmethod
+  def raw_votes(cls, voters, chunk_size=1000):
+    """
+    the JSON of the votes of the voters who voted, streamed from the database
+    chunk by chunk, without deserializing them
+    """
+    raw_votes = voters.exclude(vote=None).annotate(raw_vote=Cast('vote', models.TextField())).values_list('raw_vote', flat=True)
+    return raw_votes.iterator(chunk_size=chunk_size)
+
   def last_cast_vote(self):
     return CastVote(vote = self.vote, vote_hash = self.vote_hash, cast_at = self.cast_at, voter=self)
 
@@ -1213,13 +1525,46 @@ class CastVote(HeliosModel):
   def get_by_voter(cls, voter):
     return cls.objects.filter(voter = voter).order_by('-cast_at')
 
+  @classmethod
+  def pending(cls, election=None):
+    """
+    cast votes waiting to be verified, except quarantined ones, which cannot be verified until they are released
+    """
+    query = cls.objects.filter(verified_at=None, invalidated_at=None).exclude(quarantined_p=True, released_from_quarantine_at=None)
+    if election:
+      query = query.filter(voter__election = election)
+
+    return query
+
+  @classmethod
+  def claim_pending(cls, limit, election=None, exclude_ids=()):
+    """
+    lock up to limit of the oldest pending cast votes that no other transaction has locked,
+    so that concurrent workers each get their own. Must be called in a transaction, which
+    should store the results. Each election is loaded once, and the voters' previous votes not at all.
+    """
+    query = cls.pending(election).select_for_update(skip_locked=True, of=('self',)).select_related('voter').defer('voter__vote')
+    if exclude_ids:
+      query = query.exclude(id__in = exclude_ids)
+    cast_votes = list(query.order_by('cast_at')[:limit])
+
+    elections = Election.objects.in_bulk(set(cast_vote.voter.election_id for cast_vote in cast_votes))
+    for cast_vote in cast_votes:
+      cast_vote.voter.election = elections[cast_vote.voter.election_id]
+
+    return cast_votes
+
   def verify_and_store(self):
     # if it's quarantined, don't let this go through
     if self.is_quarantined:
       raise Exception("cast vote is quarantined, verification and storage is delayed.")
 
     result = self.vote.verify(self.voter.election)
+    self.store_verification_result(result)
+
+    return result
 
+  def store_verification_result(self, result, tally_delta=None):
     if result:
       self.verified_at = datetime.datetime.utcnow()
     else:
@@ -1229,9 +1574,94 @@ class CastVote(HeliosModel):
     self.save()
 
     if result:
-      self.voter.store_vote(self)
+      self.voter.store_vote(self, tally_delta)
 
-    return result
+  @classmethod
+  def verify_pending_batch(cls, limit, election=None, exclude_ids=()):
+    """
+    claim a batch of pending cast votes, verify it and store the results in one transaction.
+    If that raises, the votes are verified one at a time instead, each in its own transaction,
+    so that one vote cannot hold up the others. Returns the claimed cast votes and their results,
+    None for a vote that raised: it is left pending, and callers should exclude it from
+    their next claims rather than claim it again.
+    """
+    cast_votes = []
+    try:
+      with transaction.atomic():
+        cast_votes = cls.claim_pending(limit, election, exclude_ids)
+        if not cast_votes:
+          return cast_votes, []
+        return cast_votes, cls.verify_and_store_batch(cast_votes)
+    except Exception:
+      # the claim itself failed, nothing to fall back on
+      if not cast_votes:
+        raise
+      logging.exception("failed to verify a batch of %d cast votes, verifying them one at a time" % len(cast_votes))
+
+    results = []
+    for cast_vote in cast_votes:
+      result = None
+      try:
+        with transaction.atomic():
+          # unless another worker has claimed it since
+          claimed = cls.pending().select_for_update(skip_locked=True, of=('self',)).filter(id = cast_vote.id).first()
+          if claimed:
+            result = claimed.verify_and_store()
+      except Exception:
+        logging.exception("failed to verify cast vote %d" % cast_vote.id)
+      results.append(result)
+
+    return cast_votes, results
+
+  @classmethod
+  def verify_and_store_batch(cls, cast_votes):
+    """
+    verify and store many cast votes, checking the proofs of all the votes
+    of an election at once. Quarantined votes are left alone.
+    Returns a list of results, None for the votes that were left alone.
+    """
+    from helios.workflows import homomorphic
+
+    cast_votes = list(cast_votes)
+    results = [None] * len(cast_votes)
+
+    # group by election, the aggregate verification is per public key
+    by_election = {}
+    for cast_vote_num, cast_vote in enumerate(cast_votes):
+      if cast_vote.is_quarantined:
+        continue
+      by_election.setdefault(cast_vote.voter.election_id, []).append(cast_vote_num)
+
+    for cast_vote_nums in by_election.values():
+      election = cast_votes[cast_vote_nums[0]].voter.election
+      election_results = homomorphic.EncryptedVote.verify_batch(election, [cast_votes[n].vote for n in cast_vote_nums])
+
+      for cast_vote_num, result in zip(cast_vote_nums, election_results):
+        results[cast_vote_num] = result
+
+    cls.store_verification_results(cast_votes, results)
+    return results
+
+  @classmethod
+  def store_verification_results(cls, cast_votes, results):
+    """
+    store the outcome of verifying many cast votes in one transaction,
+    a result of None leaves the cast vote alone.
+    """
+    with transaction.atomic():
+      elections = {cast_vote.voter.election_id: cast_vote.voter.election
+                   for cast_vote, result in zip(cast_votes, results) if result}
+      tally_deltas = {election_id: election.init_tally_delta() for election_id, election in elections.items()}
+
+      # the voters' rows are locked in a consistent order
+      stored = sorted([(cast_vote, result) for cast_vote, result in zip(cast_votes, results) if result is not None],
+                      key=lambda stored_result: stored_result[0].voter_id)
+      for cast_vote, result in stored:
+        cast_vote.store_verification_result(result, tally_deltas.get(cast_vote.voter.election_id))
+
+      # then one update of the running tally of each election, in a consistent order too
+      for election_id in sorted(elections):
+        elections[election_id].add_to_running_tally(tally_deltas[election_id])
 
   def issues(self, election):
     """
@@ -1245,6 +1675,123 @@ class CastVote(HeliosModel):
 
     return issues
 
+class RunningTally(models.Model):
+  """
+  the encrypted tally of the votes of an election cast so far, kept up to date as votes are stored,
+  so that closing the election only takes a snapshot of it. It is a row of its own so that
+  saving an election loaded before other votes were stored cannot overwrite it.
+  """
+  election = models.OneToOneField(Election, on_delete=models.CASCADE, primary_key=True)
+  tally = LDObjectField(type_hint = 'legacy/Tally')
+
+  # Voter.votes_digest() of the votes counted in the tally, in hex
+  votes_digest = models.CharField(max_length=100)
+
+  class Meta:
+    app_label = 'helios'
+
+class TallyShard(models.Model):
+  """
+  the partial tally of the votes of a range of voters, so that
+  large elections can be tallied by many tasks at once
+  """
+  election = models.ForeignKey(Election, on_delete=models.CASCADE)
+
+  # the ids of the first and last voters in the shard
+  first_voter_id = models.IntegerField()
+  last_voter_id = models.IntegerField()
+
+  # null until the shard is computed
+  tally = LDObjectField(type_hint = 'legacy/Tally', null=True)
+  computed_at = models.DateTimeField(null=True)
+
+  # Voter.votes_digest() of the votes the tally counts, in hex
+  votes_digest = models.CharField(max_length=100, null=True)
+
+  class Meta:
+    app_label = 'helios'
+    unique_together = (('election', 'first_voter_id'),)
+
+  @classmethod
+  def get_or_create_for_election(cls, election, shard_size):
+    """
+    split the voters who voted into shards of shard_size voters by id,
+    unless an earlier attempt at tallying the election already did. The shards it
+    computed are kept, unless votes were stored for their voters since.
+    """
+    # tasks tallying the election at the same time take turns, so only one of them creates the shards
+    with transaction.atomic():
+      Election.objects.select_for_update().get(id=election.id)
+
+      shards = cls.objects.filter(election = election).order_by('first_voter_id').defer('tally')
+      if shards.exists():
+        stale_ids = [shard.id for shard in shards if shard.computed_at is not None and not shard.is_current()]
+        cls.objects.filter(id__in = stale_ids).update(tally = None, computed_at = None, votes_digest = None)
+        return list(shards.all())
+
+      new_shards = []
+      voter_ids = election.voter_set.exclude(vote=None).order_by('id').values_list('id', flat=True)
+      for voter_num, voter_id in enumerate(voter_ids.iterator()):
+        if voter_num % shard_size == 0:
+          new_shards.append(cls(election = election, first_voter_id = voter_id, last_voter_id = voter_id))
+        else:
+          new_shards[-1].last_voter_id = voter_id
+
+      cls.objects.bulk_create(new_shards)
+      return list(shards)
+
+  def compute(self):
+    """
+    tally the votes of the shard's voters, unless that's already done.
+    Returns True if this was the last shard of the election left to compute.
+    """
+    if self.computed_at is not None:
+      return False
+
+    # before the ciphertexts: a vote stored in between makes the digest stale, not the tally
+    votes_digest = Voter.votes_digest(self.voters())
+
+    tally = self.election.init_tally()
+    tally.add_ciphertexts(self.election.cast_vote_ciphertexts(self.voters()))
+
+    # shards finishing at the same time take turns, so only one of them is the last
+    with transaction.atomic():
+      Election.objects.select_for_update().get(id=self.election_id)
+
+      self.tally = tally
+      self.votes_digest = '%x' % votes_digest
+      self.computed_at = datetime.datetime.utcnow()
+      self.save()
+
+      return not TallyShard.objects.filter(election_id = self.election_id, computed_at = None).exists()
+
+  def voters(self):
+    return self.election.voter_set.exclude(vote=None).filter(id__gte = self.first_voter_id, id__lte = self.last_voter_id)
+
+  def is_current(self):
+    """
+    does the shard's tally count the last votes of its voters?
+    """
+    return self.votes_digest is not None and int(self.votes_digest, 16) == Voter.votes_digest(self.voters())
+
+
+class VoteCiphertexts(models.Model):
+  """
+  the ciphertexts of the choices of a voter's last vote, packed by pack_vote_ciphertexts,
+  so that tallies and verifiers can read them without the rest of the vote
+  """
+  voter = models.OneToOneField(Voter, on_delete=models.CASCADE, primary_key=True, related_name='vote_ciphertexts')
+  election = models.ForeignKey(Election, on_delete=models.CASCADE)
+
+  # the hash of the vote the ciphertexts come from
+  vote_hash = models.CharField(max_length=100)
+
+  ciphertexts = models.BinaryField()
+
+  class Meta:
+    app_label = 'helios'
+
+
 class AuditedBallot(models.Model):
   """
   ballots for auditing
@@ -1308,6 +1855,10 @@ class Trustee(HeliosModel):
   decryption_proofs = LDObjectField(type_hint = datatypes.arrayOf(datatypes.arrayOf('legacy/EGZKProof')),
                                     null=True)
 
+  # decryption factors and proofs computed so far by the Helios trustee:
+  # {"tally_hash": hash of the encrypted tally, "cells": {"question_num,answer_num": [factor, proof]}}
+  decryption_checkpoint = JSONField(null=True)
+
   class Meta:
     unique_together = (('election', 'email'))
     app_label = 'helios'
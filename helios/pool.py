@@ -0,0 +1,65 @@
+"""
+Worker process pools for the crypto-heavy jobs
+
+Big-integer arithmetic holds the GIL, so a single process only ever uses one core.
+A WorkerPool runs module-level functions on a pool of forked worker processes: they
+start out with the modules and fixed-base tables already loaded by the parent, and
+they never touch the database. With a single worker, everything runs in-process.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+
+
+class WorkerPool(object):
+    """
+    A pool of worker processes, started on first use and kept until shutdown(),
+    so it can serve many batches.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+
+        # daemonic processes, like prefork celery workers, cannot have children
+        if multiprocessing.current_process().daemon:
+            self.workers = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def submit(self, fn, *args):
+        # with a single worker there is nothing to gain from another process
+        if self.workers == 1:
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('fork'))
+
+        return self.executor.submit(fn, *args)
+
+    def imap_unordered(self, fn, args_list):
+        """
+        yields (index in args_list, result of fn(*args)) as each call completes.
+        In-process, each call only runs when the previous result has been consumed.
+        """
+        if self.workers == 1:
+            for index, args in enumerate(args_list):
+                yield index, fn(*args)
+            return
+
+        futures = dict((self.submit(fn, *args), index) for index, args in enumerate(args_list))
+        for future in as_completed(futures):
+            yield futures[future], future.result()
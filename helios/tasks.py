@@ -8,33 +8,116 @@ import copy
 from celery import shared_task
 from celery.utils.log import get_logger
 from django.conf import settings
+from django.db import transaction
 from django.urls import reverse
 from urllib.parse import urlparse
 
 from . import signals
 from . import utils
-from .models import CastVote, Election, Voter, VoterFile, EmailOptOut
+from .models import CastVote, Election, TallyShard, Voter, VoterFile, EmailOptOut
 from .view_utils import render_template_raw
 
 
+def _cast_votes_verified(cast_votes, results, status_update_message=None):
+    """
+    queue the notifications of the verified cast votes, and log the ones that failed
+    """
+    verified_ids = []
+    for cast_vote, result in zip(cast_votes, results):
+        # quarantined votes, and those whose verification raised, were not stored
+        if result is None:
+            continue
+
+        if result:
+            verified_ids.append(cast_vote.id)
+        else:
+            logger = get_logger(cast_vote_verify_and_store.__name__)
+            logger.error("Failed to verify and store %d" % cast_vote.id)
+
+    if verified_ids:
+        cast_votes_notify.delay(verified_ids)
+        if status_update_message:
+            cast_votes_update_status.delay(verified_ids, status_update_message)
+
+
+@shared_task(bind=True, max_retries=5)
+def cast_votes_notify(self, cast_vote_ids):
+    """
+    send the vote_cast signal for a batch of verified cast votes. This runs on its
+    own queue (HELIOS_NOTIFICATION_QUEUE), and only the cast votes whose signal failed
+    are retried, so that voters are not notified twice.
+    """
+    cast_votes = CastVote.objects.filter(id__in=cast_vote_ids).select_related('voter__election')
+
+    failed_ids = []
+    for cast_vote in cast_votes:
+        voter = cast_vote.voter
+        election = voter.election
+
+        try:
+            signals.vote_cast.send(sender=election, election=election, user=voter.get_user(), voter=voter, cast_vote=cast_vote)
+        except Exception:
+            get_logger(cast_votes_notify.__name__).exception("Failed to notify cast vote %d" % cast_vote.id)
+            failed_ids.append(cast_vote.id)
+
+    if failed_ids:
+        raise self.retry(args=(failed_ids,), countdown=60 * 2 ** self.request.retries)
+
+
+@shared_task(bind=True, max_retries=5)
+def cast_votes_update_status(self, cast_vote_ids, status_update_message):
+    """
+    post the status update of the users of a batch of verified cast votes, retrying
+    only those that failed. Separate from cast_votes_notify, so a failed status update
+    does not send the vote_cast signal again.
+    """
+    cast_votes = CastVote.objects.filter(id__in=cast_vote_ids).select_related('voter__election')
+
+    failed_ids = []
+    for cast_vote in cast_votes:
+        user = cast_vote.voter.get_user()
+
+        try:
+            if user.can_update_status():
+                user.update_status(status_update_message)
+        except Exception:
+            get_logger(cast_votes_update_status.__name__).exception("Failed to update the status of cast vote %d" % cast_vote.id)
+            failed_ids.append(cast_vote.id)
+
+    if failed_ids:
+        raise self.retry(args=(failed_ids, status_update_message), countdown=60 * 2 ** self.request.retries)
+
+
 @shared_task
 def cast_vote_verify_and_store(cast_vote_id, status_update_message=None, **kwargs):
-    cast_vote = CastVote.objects.get(id=cast_vote_id)
-    result = cast_vote.verify_and_store()
+    with transaction.atomic():
+        # unless a batch has it, or it was verified already
+        cast_vote = CastVote.pending().select_for_update(skip_locked=True, of=('self',)).filter(id=cast_vote_id).first()
+        if not cast_vote:
+            return
+
+        result = cast_vote.verify_and_store()
+
+    _cast_votes_verified([cast_vote], [result], status_update_message)
 
-    voter = cast_vote.voter
-    election = voter.election
-    user = voter.get_user()
 
-    if result:
-        # send the signal
-        signals.vote_cast.send(sender=election, election=election, user=user, voter=voter, cast_vote=cast_vote)
+@shared_task
+def cast_votes_verify_pending(batch_size=None, exclude_ids=()):
+    """
+    claim a batch of the oldest pending cast votes that no other worker has claimed,
+    verify them with aggregate proof verification and store the results in bulk.
+    The votes whose verification raised are left pending, and another task claims
+    the votes behind them, excluding these. Returns the number of cast votes claimed.
+    """
+    cast_votes, results = CastVote.verify_pending_batch(batch_size or settings.HELIOS_VERIFY_BATCH_SIZE, exclude_ids=exclude_ids)
 
-        if status_update_message and user.can_update_status():
-            user.update_status(status_update_message)
-    else:
-        logger = get_logger(cast_vote_verify_and_store.__name__)
-        logger.error("Failed to verify and store %d" % cast_vote_id)
+    _cast_votes_verified(cast_votes, results)
+
+    failed_ids = [cast_vote.id for cast_vote, result in zip(cast_votes, results) if result is None]
+    if failed_ids:
+        cast_votes_verify_pending.delay(batch_size, list(exclude_ids) + failed_ids)
+
+    return len(cast_votes)
 
 
 @shared_task
@@ -108,12 +191,8 @@ def single_voter_notify(voter_uuid, notification_template, extra_vars={}):
     voter.send_notification(notification)
 
 
-@shared_task
-def election_compute_tally(election_id):
-    election = Election.objects.get(id=election_id)
-    election.compute_tally()
-
-    election_notify_admin.delay(election_id=election_id,
+def _election_tally_computed(election):
+    election_notify_admin.delay(election_id=election.id,
                                 subject="encrypted tally computed",
                                 body="""
 The encrypted tally for election %s has been computed.
@@ -126,6 +205,48 @@ Helios
         tally_helios_decrypt.delay(election_id=election.id)
 
 
+@shared_task
+def election_compute_tally(election_id):
+    election = Election.objects.get(id=election_id)
+
+    # the running tally has every vote, no need to go through the ballots
+    if election.running_tally_complete:
+        election.compute_tally()
+        _election_tally_computed(election)
+        return
+
+    # otherwise tally shards of the voters in parallel, skipping those done by an earlier attempt
+    shards = TallyShard.get_or_create_for_election(election, settings.HELIOS_TALLY_SHARD_SIZE)
+    pending_shards = [shard for shard in shards if shard.computed_at is None]
+
+    for shard in pending_shards:
+        tally_shard_compute.delay(shard.id)
+
+    if not pending_shards:
+        election_combine_tally_shards.delay(election_id)
+
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=5)
+def tally_shard_compute(tally_shard_id):
+    shard = TallyShard.objects.get(id=tally_shard_id)
+
+    # the last shard to be computed combines them all
+    if shard.compute():
+        election_combine_tally_shards.delay(shard.election_id)
+
+
+@shared_task
+def election_combine_tally_shards(election_id):
+    election = Election.objects.get(id=election_id)
+
+    # votes were stored after the shards were computed, start over
+    if not election.combine_tally_shards():
+        election_compute_tally.delay(election_id)
+        return
+
+    _election_tally_computed(election)
+
+
 @shared_task
 def tally_helios_decrypt(election_id):
     election = Election.objects.get(id=election_id)
@@ -3,8 +3,15 @@ Unit Tests for Helios
 """
 
 import datetime
+import io
 import logging
+import multiprocessing
+import os
+import pickle
 import re
+import tempfile
+import threading
+import unittest
 import uuid
 from urllib.parse import urlencode
 
@@ -12,15 +19,22 @@ import django_webtest
 from django.conf import settings
 from django.core import mail
 from django.core.files import File
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
 from django.utils.html import escape as html_escape
 
 import helios.datatypes as datatypes
 import helios.models as models
 import helios.utils as utils
 import helios.views as views
-from helios import tasks
-from helios.crypto import electionalgs
+from helios import benchmarks, signals, tasks
+from helios.crypto import algs, backend, batch, dlogfile, electionalgs, elgamal, fixedbase, multiexp, randpool
+from helios.crypto import utils as cryptoutils
+from helios.datatypes import compact
+from helios.datatypes.core import DecimalInt
+from helios.decryption import DecryptionEngine
+from helios.workflows import homomorphic
 from helios_auth import models as auth_models
 
 
@@ -195,6 +209,31 @@ class ElectionModelTests(TestCase):
         # make sure it logged something
         self.assertTrue(len(self.election.get_log().all()) > 0)
 
+    def test_frozen_hash(self):
+        self.setup_questions()
+        self.setup_trustee()
+        self.setup_openreg()
+        self.election.freeze()
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(election.election_hash, election.compute_hash())
+        self.assertEqual(election.hash, election.election_hash)
+        self.assertTrue(election.check_hash())
+
+        # tampering with the election shows
+        models.Election.objects.filter(id=election.id).update(name='Other Name')
+        election = models.Election.objects.get(id=election.id)
+        self.assertNotEqual(election.hash, election.compute_hash())
+        self.assertFalse(election.check_hash())
+        with self.assertRaises(CommandError):
+            call_command('check_election_hashes', stdout=io.StringIO())
+
+        # elections frozen before the hash was stored get it on first use
+        models.Election.objects.filter(id=election.id).update(election_hash=None)
+        election = models.Election.objects.get(id=election.id)
+        self.assertEqual(election.hash, election.compute_hash())
+        self.assertEqual(models.Election.objects.get(id=election.id).election_hash, election.hash)
+
     def test_archive(self):
         self.election.archived_at = datetime.datetime.utcnow()
         self.assertTrue(self.election.is_archived)
@@ -505,6 +544,564 @@ class CastVoteModelTests(TestCase):
     def test_cast_vote(self):
         pass
 
+class CastVotesMixin(object):
+    """
+    an election with four cast votes waiting to be verified, the third one with a bad proof
+    """
+    fixtures = ['users.json']
+
+    def setUp(self):
+        self.user = auth_models.User.objects.get(user_id='ben@adida.net', user_type='google')
+        self.election, _ = models.Election.get_or_create(
+            short_name='test-cast-vote-verification',
+            name='Test Verification Engine',
+            description='Test Election for the Verification Engine',
+            admin=self.user
+        )
+        self.election.questions = [{"answer_urls": [None, None], "answers": ["Yes", "No"], "choice_type": "approval", "max": 1, "min": 0, "question": "Test?", "result_type": "absolute", "short_name": "Test?", "tally_type": "homomorphic"}]
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+        self.election.openreg = True
+        self.election.freeze()
+
+        self.cast_votes = []
+        for voter_num in range(4):
+            voter = models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_email='voter%d@example.com' % voter_num,
+                                                voter_name='Voter %d' % voter_num, voter_login_id='voter%d' % voter_num)
+            vote = homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, [[voter_num % 2]])
+            cast_vote = models.CastVote(voter=voter, vote=vote, vote_hash=vote.hash)
+            cast_vote.save()
+            self.cast_votes.append(cast_vote)
+
+        # tamper with one of the answers' proofs
+        bad_vote = self.cast_votes[2].vote
+        bad_vote.encrypted_answers[0].individual_proofs[0].proofs[0].response += 1
+        self.cast_votes[2].save()
+
+
+class CastVoteVerificationTests(CastVotesMixin, TestCase):
+    allow_database_queries = True
+
+    def test_verify_pending_task(self):
+        self.cast_votes[0].quarantined_p = True
+        self.cast_votes[0].save()
+
+        self.assertEqual(tasks.cast_votes_verify_pending(batch_size=2), 2)
+        self.assertEqual(tasks.cast_votes_verify_pending(batch_size=2), 1)
+        self.assertEqual(tasks.cast_votes_verify_pending(batch_size=2), 0)
+
+        for cast_vote_num, cast_vote in enumerate(self.cast_votes):
+            cast_vote.refresh_from_db()
+            self.assertEqual(cast_vote.verified_at is not None, cast_vote_num in (1, 3))
+            self.assertEqual(cast_vote.invalidated_at is not None, cast_vote_num == 2)
+
+        self.assertEqual(self.election.voter_set.exclude(vote_hash=None).count(), 2)
+        self.assertTrue(self.election.check_running_tally())
+
+        # a vote that was verified by a batch is left alone
+        tasks.cast_vote_verify_and_store(self.cast_votes[2].id)
+        self.cast_votes[2].refresh_from_db()
+        self.assertIsNone(self.cast_votes[2].verified_at)
+
+    def test_verify_pending_task_failed_vote(self):
+        from unittest.mock import patch
+
+        verify_and_store = models.CastVote.verify_and_store
+        def failing_verify_and_store(cast_vote):
+            if cast_vote.id == self.cast_votes[1].id:
+                raise Exception("cannot verify")
+            return verify_and_store(cast_vote)
+
+        # the batch falls back to one vote at a time, and the next task skips the failed vote
+        with patch.object(models.CastVote, 'verify_and_store_batch', side_effect=Exception("cannot verify batch")), \
+             patch.object(models.CastVote, 'verify_and_store', failing_verify_and_store):
+            self.assertEqual(tasks.cast_votes_verify_pending(batch_size=2), 2)
+
+        for cast_vote_num, cast_vote in enumerate(self.cast_votes):
+            cast_vote.refresh_from_db()
+            self.assertEqual(cast_vote.verified_at is not None, cast_vote_num in (0, 3))
+            self.assertEqual(cast_vote.invalidated_at is not None, cast_vote_num == 2)
+
+        self.assertEqual([cast_vote.id for cast_vote in models.CastVote.pending()], [self.cast_votes[1].id])
+        self.assertEqual(self.election.voter_set.exclude(vote_hash=None).count(), 2)
+        self.assertTrue(self.election.check_running_tally())
+
+    def test_notifications_retried(self):
+        notified_ids = []
+
+        def receiver(cast_vote, **kwargs):
+            notified_ids.append(cast_vote.id)
+            # the first notification of one of the votes fails
+            if notified_ids.count(cast_vote.id) == 1 and cast_vote.id == self.cast_votes[3].id:
+                raise Exception("provider unavailable")
+
+        signals.vote_cast.connect(receiver)
+        try:
+            self.assertEqual(tasks.cast_votes_verify_pending(batch_size=4), 4)
+        finally:
+            signals.vote_cast.disconnect(receiver)
+
+        expected_ids = [self.cast_votes[num].id for num in (0, 1, 3, 3)]
+        self.assertEqual(sorted(notified_ids), sorted(expected_ids))
+
+    def test_status_update_retried_alone(self):
+        from unittest.mock import patch
+
+        notified_ids = []
+        def receiver(cast_vote, **kwargs):
+            notified_ids.append(cast_vote.id)
+
+        status_updates = []
+        def update_status(user, message):
+            status_updates.append(message)
+            # the first status update fails
+            if len(status_updates) == 1:
+                raise Exception("provider unavailable")
+
+        signals.vote_cast.connect(receiver)
+        try:
+            with patch.object(auth_models.User, 'can_update_status', return_value=True), \
+                 patch.object(auth_models.User, 'update_status', update_status):
+                tasks.cast_vote_verify_and_store(self.cast_votes[0].id, status_update_message="I voted")
+        finally:
+            signals.vote_cast.disconnect(receiver)
+
+        self.assertEqual(notified_ids, [self.cast_votes[0].id])
+        self.assertEqual(status_updates, ["I voted", "I voted"])
+
+    def test_verify_cast_votes_command(self):
+        out = io.StringIO()
+        call_command('verify_cast_votes', workers=1, batch_size=3, election=self.election.uuid, stdout=out)
+        self.assertIn("3 verified, 1 invalid", out.getvalue())
+        self.assertIn("0 pending", out.getvalue())
+        self.assertEqual(self.election.voter_set.exclude(vote_hash=None).count(), 3)
+
+        with self.assertRaises(CommandError):
+            call_command('verify_cast_votes', workers=1, election='no-such-election', stdout=io.StringIO())
+
+    def test_verify_cast_votes_command_failed_vote(self):
+        from unittest.mock import patch
+
+        verify_and_store = models.CastVote.verify_and_store
+        def failing_verify_and_store(cast_vote):
+            if cast_vote.id == self.cast_votes[1].id:
+                raise Exception("cannot verify")
+            return verify_and_store(cast_vote)
+
+        # batches fall back to one vote at a time, and the failed vote is not claimed again
+        out = io.StringIO()
+        with patch.object(models.CastVote, 'verify_and_store_batch', side_effect=Exception("cannot verify batch")), \
+             patch.object(models.CastVote, 'verify_and_store', failing_verify_and_store):
+            with self.assertRaises(CommandError):
+                call_command('verify_cast_votes', workers=1, batch_size=2, stdout=out)
+
+        self.assertIn("2 verified, 1 invalid, 1 failed", out.getvalue())
+        self.assertEqual([cast_vote.id for cast_vote in models.CastVote.pending()], [self.cast_votes[1].id])
+
+
+@unittest.skipUnless(connection.features.has_select_for_update_skip_locked, "needs SELECT ... FOR UPDATE SKIP LOCKED")
+class SkipLockedClaimTests(CastVotesMixin, TransactionTestCase):
+    """
+    row locks need a database that has them, like the PostgreSQL of the CI
+    """
+
+    def _hold_claim(self, limit):
+        """
+        claim pending cast votes from another connection, and keep them locked until release is set
+        """
+        held_ids = []
+        claimed = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    held_ids.extend(cast_vote.id for cast_vote in models.CastVote.claim_pending(limit))
+                    claimed.set()
+                    release.wait(30)
+            finally:
+                claimed.set()
+                connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        self.assertTrue(claimed.wait(30))
+        return held_ids, release, thread
+
+    def test_concurrent_claims(self):
+        held_ids, release, thread = self._hold_claim(2)
+        try:
+            self.assertEqual(held_ids, [cast_vote.id for cast_vote in self.cast_votes[:2]])
+
+            with transaction.atomic():
+                claimed_ids = [cast_vote.id for cast_vote in models.CastVote.claim_pending(10)]
+            self.assertEqual(claimed_ids, [cast_vote.id for cast_vote in self.cast_votes[2:]])
+
+            # the per-vote task leaves a vote held by a batch alone
+            tasks.cast_vote_verify_and_store(held_ids[0])
+            cast_vote = models.CastVote.objects.get(id=held_ids[0])
+            self.assertIsNone(cast_vote.verified_at)
+            self.assertIsNone(cast_vote.invalidated_at)
+        finally:
+            release.set()
+            thread.join()
+
+    def test_verify_pending_skips_held_votes(self):
+        held_ids, release, thread = self._hold_claim(1)
+        try:
+            self.assertEqual(tasks.cast_votes_verify_pending(batch_size=10), 3)
+        finally:
+            release.set()
+            thread.join()
+
+        # once released, the held vote is still pending
+        self.assertEqual([cast_vote.id for cast_vote in models.CastVote.pending()], held_ids)
+        self.assertEqual(tasks.cast_votes_verify_pending(batch_size=10), 1)
+
+
+@unittest.skipUnless(connection.features.has_select_for_update, "needs SELECT ... FOR UPDATE")
+class ConcurrentTallyShardTests(CastVotesMixin, TransactionTestCase):
+    def test_concurrent_shard_creation(self):
+        tasks.cast_votes_verify_pending(batch_size=10)
+
+        # two tasks start tallying the election at the same time
+        start = threading.Barrier(2)
+        shard_ids = []
+        errors = []
+
+        def tally_shards():
+            try:
+                start.wait(30)
+                shards = models.TallyShard.get_or_create_for_election(models.Election.objects.get(id=self.election.id), 1)
+                shard_ids.append([shard.id for shard in shards])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=tally_shards) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(shard_ids[0]), 3)
+        self.assertEqual(shard_ids[0], shard_ids[1])
+
+
+class RunningTallyTests(TestCase):
+    fixtures = ['users.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.user = auth_models.User.objects.get(user_id='ben@adida.net', user_type='google')
+        self.election, _ = models.Election.get_or_create(
+            short_name='test-running-tally',
+            uuid=str(uuid.uuid4()),
+            name='Test Running Tally',
+            description='Test Election for the Running Tally',
+            admin=self.user
+        )
+        self.election.questions = [{"answer_urls": [None, None], "answers": ["Yes", "No"], "choice_type": "approval", "max": 1, "min": 0, "question": "Test?", "result_type": "absolute", "short_name": "Test?", "tally_type": "homomorphic"}]
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+        self.election.openreg = True
+        self.election.freeze()
+
+        self.voters = [models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_email='voter%d@example.com' % voter_num,
+                                                   voter_name='Voter %d' % voter_num, voter_login_id='voter%d' % voter_num)
+                       for voter_num in range(3)]
+
+    def _cast_vote(self, voter, answer):
+        vote = homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, [[answer]])
+        cast_vote = models.CastVote(voter=voter, vote=vote, vote_hash=vote.hash, cast_at=datetime.datetime.utcnow())
+        cast_vote.save()
+        return cast_vote
+
+    def _counts(self, tally):
+        tally.init_election(self.election)
+        sk = self.election.get_helios_trustee().secret_key
+        factors = [[[sk.decryption_factor(ciphertext) for ciphertext in tally.tally[0]]]]
+        return tally.decrypt_from_factors(factors, self.election.public_key)[0]
+
+    def test_store_and_recast(self):
+        self._cast_vote(self.voters[0], 0).store_verification_result(True)
+        models.CastVote.store_verification_results([self._cast_vote(self.voters[1], 1), self._cast_vote(self.voters[2], 0)], [True, True])
+
+        # the first voter changes their mind, the second one's vote is invalid
+        self._cast_vote(self.voters[0], 1).store_verification_result(True)
+        self._cast_vote(self.voters[1], 0).store_verification_result(False)
+
+        election = models.Election.objects.get(id=self.election.id)
+        running_tally = election.get_running_tally()
+        self.assertEqual(running_tally.num_tallied, 3)
+        self.assertEqual(self._counts(running_tally), [1, 2])
+        self.assertTrue(election.check_running_tally())
+
+        election.compute_tally()
+        self.assertEqual(self._counts(election.encrypted_tally), [1, 2])
+
+    def test_batch_tally_delta(self):
+        from unittest.mock import patch
+
+        self._cast_vote(self.voters[0], 0).store_verification_result(True)
+
+        # the first voter recasts twice in the same batch, the others vote for the first time
+        cast_votes = [self._cast_vote(self.voters[0], 1), self._cast_vote(self.voters[1], 1),
+                      self._cast_vote(self.voters[0], 0), self._cast_vote(self.voters[2], 0)]
+        with patch.object(models.Election, 'add_to_running_tally', autospec=True,
+                          side_effect=models.Election.add_to_running_tally) as add_to_running_tally:
+            models.CastVote.store_verification_results(cast_votes, [True] * len(cast_votes))
+
+        # the running tally is updated once for the whole batch
+        self.assertEqual(add_to_running_tally.call_count, 1)
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(self._counts(election.get_running_tally()), [2, 1])
+        self.assertTrue(election.check_running_tally())
+
+    def test_voter_delete(self):
+        for voter in self.voters:
+            self._cast_vote(voter, 1).store_verification_result(True)
+
+        models.Voter.objects.get(id=self.voters[0].id).delete()
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(self._counts(election.get_running_tally()), [0, 2])
+        self.assertTrue(election.check_running_tally())
+
+    def test_votes_before_running_tally(self):
+        for voter in self.voters[:2]:
+            self._cast_vote(voter, 0).store_verification_result(True)
+        models.RunningTally.objects.filter(election=self.election).delete()
+
+        self._cast_vote(self.voters[2], 1).store_verification_result(True)
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(self._counts(election.get_running_tally()), [2, 1])
+        self.assertTrue(election.check_running_tally())
+
+    def test_inconsistent_running_tally(self):
+        for voter in self.voters:
+            self._cast_vote(voter, 0).store_verification_result(True)
+
+        election = models.Election.objects.get(id=self.election.id)
+        running_tally = models.RunningTally.objects.get(election=election)
+        running_tally.tally.tally[0][1] = running_tally.tally.tally[0][0]
+        running_tally.save()
+        self.assertFalse(election.check_running_tally())
+
+        # a running tally that missed votes is not used
+        running_tally.tally.num_tallied = 2
+        running_tally.save()
+        self.assertIsNone(election.get_running_tally())
+        election.compute_tally()
+        self.assertEqual(self._counts(election.encrypted_tally), [3, 0])
+
+    def test_stale_election_save(self):
+        for voter in self.voters:
+            self._cast_vote(voter, 0).store_verification_result(True)
+
+        # loaded before the first voter recasts their vote, saved after
+        stale_election = models.Election.objects.get(id=self.election.id)
+        stale_running_tally = models.RunningTally.objects.get(election=self.election)
+        self._cast_vote(self.voters[0], 1).store_verification_result(True)
+        stale_election.save()
+        self.assertTrue(self.election.check_running_tally())
+
+        # a lost recast leaves the count as it was, but not the digest of the votes
+        stale_running_tally.save()
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(stale_running_tally.tally.num_tallied, election.num_cast_votes)
+        self.assertFalse(election.running_tally_complete)
+
+        election.compute_tally()
+        self.assertEqual(self._counts(election.encrypted_tally), [2, 1])
+
+    def test_raw_votes(self):
+        vote = homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, [[1]])
+        raw_vote = datatypes.LDObject.instantiate(vote, datatype='legacy/EncryptedVote').serialize()
+        self.assertEqual(homomorphic.vote_ciphertexts(raw_vote),
+                         [[(choice.alpha, choice.beta) for choice in vote.encrypted_answers[0].choices]])
+
+        tally = self.election.init_tally()
+        tally.add_raw_votes([raw_vote, raw_vote])
+        self.assertEqual(tally.num_tallied, 2)
+        self.assertEqual(self._counts(tally), [0, 2])
+
+        # one question too many
+        with self.assertRaises(ValueError):
+            tally.add_raw_votes([raw_vote.replace('"answers": [', '"answers": [{"choices": []}, ', 1)])
+
+    def test_vote_ciphertexts(self):
+        cast_votes = [self._cast_vote(voter, 0) for voter in self.voters]
+        for cast_vote in cast_votes:
+            cast_vote.store_verification_result(True)
+
+        for cast_vote in cast_votes:
+            packed = models.VoteCiphertexts.objects.get(voter=cast_vote.voter)
+            self.assertEqual(packed.vote_hash, cast_vote.vote_hash)
+            self.assertEqual(self.election.unpack_vote_ciphertexts(packed.ciphertexts), cast_vote.vote.choice_ciphertexts())
+
+        response = self.client.get("/helios/elections/%s/ballots/ciphertexts" % self.election.uuid, {'limit': 2})
+        ballots = utils.from_json(response.content.decode())['ballots']
+        self.assertEqual([ballot['voter_uuid'] for ballot in ballots], sorted(voter.uuid for voter in self.voters)[:2])
+
+        # votes stored before there were packed copies
+        models.VoteCiphertexts.objects.all().delete()
+        self.assertEqual(self._counts(self.election.tally_cast_votes()), [3, 0])
+        self._cast_vote(self.voters[0], 1).store_verification_result(True)
+        self.assertEqual(self.election.pack_cast_vote_ciphertexts(), 2)
+        self.assertEqual(self._counts(self.election.tally_cast_votes()), [2, 1])
+        self.assertTrue(self.election.check_running_tally())
+
+    def _cast_votes_without_running_tally(self):
+        for voter_num, voter in enumerate(self.voters):
+            self._cast_vote(voter, voter_num // 2).store_verification_result(True)
+        models.RunningTally.objects.filter(election=self.election).delete()
+
+    def test_sharded_tally(self):
+        self._cast_votes_without_running_tally()
+
+        with self.settings(HELIOS_TALLY_SHARD_SIZE=2):
+            tasks.election_compute_tally(self.election.id)
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(election.encrypted_tally.num_tallied, 3)
+        self.assertEqual(self._counts(election.encrypted_tally), [2, 1])
+        self.assertFalse(models.TallyShard.objects.filter(election=election).exists())
+
+    def test_tally_shard_checkpoint(self):
+        self._cast_votes_without_running_tally()
+
+        shards = models.TallyShard.get_or_create_for_election(self.election, 2)
+        self.assertEqual([(shard.first_voter_id, shard.last_voter_id) for shard in shards],
+                         [(self.voters[0].id, self.voters[1].id), (self.voters[2].id, self.voters[2].id)])
+        self.assertFalse(shards[0].compute())
+
+        # a second attempt keeps the computed shard
+        computed_at = models.TallyShard.objects.get(id=shards[0].id).computed_at
+        shards = models.TallyShard.get_or_create_for_election(self.election, 2)
+        self.assertEqual(shards[0].computed_at, computed_at)
+
+        # unless one of its voters cast a new vote since
+        self._cast_vote(self.voters[0], 1).store_verification_result(True)
+        models.RunningTally.objects.filter(election=self.election).delete()
+        shards = models.TallyShard.get_or_create_for_election(self.election, 2)
+        self.assertIsNone(shards[0].computed_at)
+
+        tasks.election_compute_tally(self.election.id)
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(self._counts(election.encrypted_tally), [1, 2])
+
+    def test_tally_shards_missing_votes(self):
+        self._cast_votes_without_running_tally()
+        for shard in models.TallyShard.get_or_create_for_election(self.election, 2):
+            shard.compute()
+
+        # a vote stored after the shards were made
+        voter = models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_email='voter3@example.com',
+                                            voter_name='Voter 3', voter_login_id='voter3')
+        self._cast_vote(voter, 1).store_verification_result(True)
+        models.RunningTally.objects.filter(election=self.election).delete()
+
+        with self.settings(HELIOS_TALLY_SHARD_SIZE=2):
+            tasks.election_combine_tally_shards(self.election.id)
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(election.encrypted_tally.num_tallied, 4)
+        self.assertEqual(self._counts(election.encrypted_tally), [2, 2])
+        self.assertFalse(models.TallyShard.objects.filter(election=election).exists())
+
+class InterruptedDecryptionEngine(DecryptionEngine):
+    """
+    stops after the first chunk, like a killed worker
+    """
+    def imap_unordered(self, fn, args_list):
+        for index, result in super(InterruptedDecryptionEngine, self).imap_unordered(fn, args_list):
+            yield index, result
+            raise RuntimeError("interrupted")
+
+class CountingDecryptionEngine(DecryptionEngine):
+    num_cells = 0
+
+    def imap_unordered(self, fn, args_list):
+        self.num_cells += sum(len(ciphertexts) for sk, ciphertexts in args_list)
+        return super(CountingDecryptionEngine, self).imap_unordered(fn, args_list)
+
+class DecryptionEngineTests(TestCase):
+    fixtures = ['users.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.user = auth_models.User.objects.get(user_id='ben@adida.net', user_type='google')
+        self.election, _ = models.Election.get_or_create(
+            short_name='test-decryption-engine',
+            name='Test Decryption Engine',
+            description='Test Election for the Decryption Engine',
+            admin=self.user
+        )
+        self.election.questions = [{"answer_urls": [None, None, None], "answers": ["A", "B", "C"], "choice_type": "approval", "max": 1, "min": 0, "question": "Q%d?" % q_num, "result_type": "absolute", "short_name": "Q%d?" % q_num, "tally_type": "homomorphic"} for q_num in range(3)]
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+        self.election.openreg = True
+        self.election.freeze()
+
+        tally = self.election.init_tally()
+        for answers in [[[0], [1], [2]], [[0], [2], [2]]]:
+            tally.add_vote(homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, answers), verify_p=False)
+        self.election.encrypted_tally = tally
+        self.election.save()
+
+    def _check_decrypted(self):
+        trustee = self.election.get_helios_trustee()
+        self.assertIsNone(trustee.decryption_checkpoint)
+        self.assertTrue(trustee.verify_decryption_proofs())
+        self.assertIsNone(self.election.helios_trustee_decryption_progress)
+
+        self.election.combine_decryptions()
+        self.assertEqual(self.election.result, [[2, 0, 0], [0, 1, 1], [0, 0, 2]])
+
+    def test_decrypt_in_process(self):
+        self.election.helios_trustee_decrypt(engine=DecryptionEngine(workers=1, chunk_size=2))
+        self._check_decrypted()
+
+    def test_decrypt_in_pool(self):
+        with DecryptionEngine(workers=2, chunk_size=2) as engine:
+            self.election.helios_trustee_decrypt(engine=engine)
+        self._check_decrypted()
+
+    def test_resume(self):
+        self.assertEqual(self.election.helios_trustee_decryption_progress, {'done': 0, 'total': 9})
+
+        self.assertRaises(RuntimeError, self.election.helios_trustee_decrypt, engine=InterruptedDecryptionEngine(workers=1, chunk_size=2))
+        self.assertEqual(self.election.helios_trustee_decryption_progress, {'done': 2, 'total': 9})
+
+        # only the missing cells are decrypted again
+        engine = CountingDecryptionEngine(workers=1, chunk_size=100)
+        self.election.helios_trustee_decrypt(engine=engine)
+        self.assertEqual(engine.num_cells, 7)
+        self._check_decrypted()
+
+    def test_resume_other_tally(self):
+        self.assertRaises(RuntimeError, self.election.helios_trustee_decrypt, engine=InterruptedDecryptionEngine(workers=1, chunk_size=2))
+
+        # a checkpoint of another tally is not reused
+        tally = self.election.init_tally()
+        for answers in [[[0], [1], [2]], [[0], [2], [2]]]:
+            tally.add_vote(homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, answers), verify_p=False)
+        self.election.encrypted_tally = tally
+        self.election.save()
+
+        engine = CountingDecryptionEngine(workers=1, chunk_size=100)
+        self.election.helios_trustee_decrypt(engine=engine)
+        self.assertEqual(engine.num_cells, 9)
+        self._check_decrypted()
+
+        # and replacing the tally drops the checkpoints
+        self.assertRaises(RuntimeError, self.election.helios_trustee_decrypt, engine=InterruptedDecryptionEngine(workers=1, chunk_size=2))
+        self.election.store_encrypted_tally(tally)
+        self.assertIsNone(self.election.get_helios_trustee().decryption_checkpoint)
+
 class DatatypeTests(TestCase):
     fixtures = ['users.json', 'election.json']
     allow_database_queries = True
@@ -531,9 +1128,506 @@ class DatatypeTests(TestCase):
         ld_obj = datatypes.LDObject.fromDict(original_dict, type_hint = 'legacy/EGZKProofCommitment')
 
         self.assertEqual(original_dict, ld_obj.toDict())
-        
-        
-        
+
+    def test_big_integer_keeps_wire_string(self):
+        commitment = datatypes.LDObject.fromDict({'A': '35423432', 'B': '0234'}, type_hint = 'legacy/EGZKProofCommitment').wrapped_obj
+
+        # canonical strings are kept, anything else is normalized as before
+        self.assertIsInstance(commitment['A'], DecimalInt)
+        self.assertEqual(commitment['A'], 35423432)
+        self.assertEqual(commitment['A'].decimal, '35423432')
+        self.assertNotIsInstance(commitment['B'], DecimalInt)
+        self.assertEqual(str(commitment['B']), '234')
+
+        # arithmetic gives plain ints, and pickling keeps the string
+        self.assertIs(type(commitment['A'] + 1), int)
+        self.assertEqual(pickle.loads(pickle.dumps(commitment['A'])).decimal, '35423432')
+
+        self.assertEqual(algs.EG_fiatshamir_challenge_generator(commitment), algs.EG_fiatshamir_challenge_generator({'A': 35423432, 'B': 234}))
+
+    def test_compact_round_trip(self):
+        self.election.public_key = self.election.get_helios_trustee().public_key
+        vote = homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, [[1]])
+        legacy_dict = datatypes.LDObject.instantiate(vote, datatype='legacy/EncryptedVote').toDict()
+
+        compact_dict = compact.legacy_to_compact(legacy_dict, 'EncryptedVote')
+        self.assertEqual(compact.compact_to_legacy(compact_dict, 'EncryptedVote'), legacy_dict)
+        self.assertLess(len(utils.to_json(compact_dict)), len(utils.to_json(legacy_dict)) * 0.6)
+
+        # fixed widths: 256 bytes for group elements, 32 bytes for exponents
+        proof = compact_dict['answers'][0]['individual_proofs'][0][0]
+        self.assertEqual(len(compact_dict['answers'][0]['choices'][0]['alpha']), 344)
+        self.assertEqual(len(proof['commitment']['A']), 344)
+        self.assertEqual(len(proof['challenge']), 44)
+
+        # the parsed vote still checks out
+        parsed_vote = datatypes.LDObject.fromDict(compact_dict, type_hint='compact/EncryptedVote').wrapped_obj
+        self.assertEqual(parsed_vote.encrypted_answers[0].choices[0].alpha, vote.encrypted_answers[0].choices[0].alpha)
+        self.assertTrue(parsed_vote.encrypted_answers[0].verify(self.election.public_key, max=1))
+
+    def test_compact_small_values(self):
+        # values shorter than the width
+        self.election.public_key = self.election.get_helios_trustee().public_key
+        tally = homomorphic.Tally(election=self.election)
+        tally.add_vote(homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, [[1]]), verify_p=False)
+        tally.tally[0][0].beta = 1
+        tally_dict = datatypes.LDObject.instantiate(tally, datatype='legacy/Tally').toDict()
+        compact_dict = compact.legacy_to_compact(tally_dict, 'Tally')
+        self.assertEqual(compact.compact_to_legacy(compact_dict, 'Tally'), tally_dict)
+
+
+class RandomTests(TestCase):
+    def test_mpz_lt(self):
+        for maximum in [1, 2, 5, 256, 2 ** 256, views.ELGAMAL_PARAMS.q]:
+            samples = [cryptoutils.random.mpz_lt(maximum) for _ in range(50)]
+            self.assertTrue(all(0 <= sample < maximum for sample in samples))
+        self.assertEqual(set(cryptoutils.random.mpz_lt(3) for _ in range(200)), {0, 1, 2})
+
+    def test_threads_get_distinct_bytes(self):
+        reads = []
+
+        def read():
+            for _ in range(200):
+                reads.append(cryptoutils.random_buffer.read(16))
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(reads)), 800)
+
+    def test_fork_does_not_share_bytes(self):
+        # make sure that the parent has a block to hand down
+        cryptoutils.random_buffer.read(1)
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(write_fd, cryptoutils.random_buffer.read(32))
+            os._exit(0)
+
+        os.waitpid(pid, 0)
+        child_bytes = os.read(read_fd, 32)
+        os.close(read_fd)
+        os.close(write_fd)
+        self.assertNotEqual(child_bytes, cryptoutils.random_buffer.read(32))
+
+
+class BenchmarkTests(TestCase):
+    def test_benchmark_crypto(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'baseline.json')
+            call_command('benchmark_crypto', 'encrypt_with_r', 'tally_add_vote', repeat=2, min_time=0,
+                         output=path, stdout=io.StringIO())
+            baseline = utils.from_json(open(path).read())
+
+            self.assertEqual(set(baseline['results']), {'encrypt_with_r', 'tally_add_vote'})
+            self.assertEqual(baseline['meta']['p_bits'], 2048)
+            result = baseline['results']['encrypt_with_r']
+            self.assertEqual(result['rounds'], 2)
+            self.assertTrue(0 < result['min'] <= result['median'])
+
+            # a baseline 100 times faster than this run
+            for result in baseline['results'].values():
+                result['median'] /= 100
+            with open(path, 'w') as f:
+                f.write(utils.to_json(baseline))
+
+            with self.assertRaises(CommandError):
+                call_command('benchmark_crypto', 'encrypt_with_r', repeat=2, min_time=0,
+                             compare=path, stdout=io.StringIO())
+
+    def test_unknown_benchmark(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_crypto', 'nonexistent', stdout=io.StringIO())
+
+
+class PublicKeyValidationTests(TestCase):
+    def setUp(self):
+        pk = views.ELGAMAL_PARAMS.generate_keypair().pk
+        self.pk_dict = {'p': str(pk.p), 'q': str(pk.q), 'g': str(pk.g), 'y': str(pk.y)}
+        algs.validate_group_params.cache_clear()
+        algs.validate_group_element.cache_clear()
+
+    def test_memoized(self):
+        for _ in range(3):
+            pk = algs.EGPublicKey.from_dict(self.pk_dict)
+        self.assertEqual(pk.y, int(self.pk_dict['y']))
+        self.assertEqual(algs.validate_group_params.cache_info().misses, 1)
+        self.assertEqual(algs.validate_group_element.cache_info().misses, 1)
+        self.assertEqual(algs.validate_group_element.cache_info().hits, 2)
+
+    def test_failures_are_not_memoized(self):
+        bad_dict = dict(self.pk_dict, y=str(int(self.pk_dict['p']) - int(self.pk_dict['y'])))
+        for _ in range(2):
+            self.assertRaises(Exception, algs.EGPublicKey.from_dict, bad_dict)
+        self.assertEqual(algs.validate_group_element.cache_info().currsize, 0)
+
+        # the same y does not pass with another group
+        algs.EGPublicKey.from_dict(self.pk_dict)
+        other_group = dict(self.pk_dict, g=str(pow(int(self.pk_dict['g']), 2, int(self.pk_dict['p']))), q=str(int(self.pk_dict['q']) + 2))
+        self.assertRaises(Exception, algs.EGPublicKey.from_dict, other_group)
+
+
+class RandomnessPoolTests(TestCase):
+    def setUp(self):
+        self.keypair = views.ELGAMAL_PARAMS.generate_keypair()
+        self.pk = self.keypair.pk
+
+    def tearDown(self):
+        randpool.remove_pool(self.pk)
+
+    def _check_triple(self, triple):
+        x, g_to_x, y_to_x = triple
+        self.assertEqual(g_to_x, pow(self.pk.g, x, self.pk.p))
+        self.assertEqual(y_to_x, pow(self.pk.y, x, self.pk.p))
+
+    def test_fill_and_take(self):
+        pool = randpool.get_pool(self.pk, size=5)
+        self.assertIs(randpool.get_pool(self.pk), pool)
+        pool.fill()
+        self.assertEqual(len(pool), 5)
+
+        triples = [randpool.take(self.pk) for _ in range(7)]
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(len(set(triple[0] for triple in triples)), 7)
+        for triple in triples:
+            self._check_triple(triple)
+
+    def test_background_process(self):
+        pool = randpool.get_pool(self.pk, size=3)
+        pool.start()
+        self._check_triple(pool.queue.get(timeout=10))
+        pool.stop()
+        self.assertIsNone(pool.process)
+
+    def test_ballots_from_pool(self):
+        randpool.get_pool(self.pk, size=20).fill()
+        plaintexts = homomorphic.EncryptedAnswer.generate_plaintexts(self.pk)
+
+        ciphertext, r = self.pk.encrypt_return_r(plaintexts[1])
+        self.assertEqual(self.keypair.sk.decrypt(ciphertext).m, plaintexts[1].m)
+
+        proof = ciphertext.generate_disjunctive_encryption_proof(plaintexts, 1, r, algs.EG_disjunctive_challenge_generator)
+        self.assertTrue(ciphertext.verify_disjunctive_encryption_proof(plaintexts, proof, algs.EG_disjunctive_challenge_generator))
+        self.assertLess(len(randpool.get_pool(self.pk)), 20)
+
+    def test_pools_not_inherited(self):
+        pool = randpool.get_pool(self.pk, size=5)
+        pool.fill()
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        process = context.Process(target=take_in_child, args=(self.pk, results))
+        process.start()
+        num_pools, x = results.get(timeout=10)
+        process.join()
+
+        self.assertEqual(num_pools, 0)
+        self.assertNotIn(x, [triple[0] for triple in pool.triples])
+        self.assertEqual(len(pool), 5)
+
+    def test_ballot_generation_uses_pool(self):
+        election = benchmarks.BenchmarkElection(self.pk, [benchmarks.QUESTION])
+        with self.settings(HELIOS_RANDOMNESS_POOL_SIZE=10):
+            vote = homomorphic.EncryptedVote.fromElectionAndAnswers(election, [[1]])
+
+        pool = randpool.get_pool(self.pk)
+        self.assertIsNotNone(pool.process)
+        self.assertTrue(vote.verify(election))
+
+
+def take_in_child(pk, results):
+    results.put((len(randpool._pools), randpool.take(pk)[0]))
+
+
+class FixedBaseTests(TestCase):
+    def setUp(self):
+        self.pk = views.ELGAMAL_PARAMS.generate_keypair().pk
+
+    def test_table_matches_pow(self):
+        p, q, g = self.pk.p, self.pk.q, self.pk.g
+        table = fixedbase.FixedBaseTable(g, p, q.bit_length())
+        for exponent in [0, 1, 63, 64, q - 1, cryptoutils.random.mpz_lt(q), 2 ** 300, -3]:
+            self.assertEqual(table.pow(exponent), pow(g, exponent, p))
+
+    def test_encryption_with_tables(self):
+        plaintexts = homomorphic.EncryptedAnswer.generate_plaintexts(self.pk)
+        ciphertext, r = self.pk.encrypt_return_r(plaintexts[1])
+
+        self.pk.precompute_tables()
+        self.assertIsNotNone(fixedbase.get_table(self.pk.y, self.pk.p))
+        self.assertEqual(ciphertext, self.pk.encrypt_with_r(plaintexts[1], r))
+
+        proof = ciphertext.generate_disjunctive_encryption_proof(plaintexts, 1, r, algs.EG_disjunctive_challenge_generator)
+        self.assertTrue(ciphertext.verify_disjunctive_encryption_proof(plaintexts, proof, algs.EG_disjunctive_challenge_generator))
+
+
+class BatchVerificationTests(TestCase):
+    def setUp(self):
+        self.pk = views.ELGAMAL_PARAMS.generate_keypair().pk
+        self.plaintexts = homomorphic.EncryptedAnswer.generate_plaintexts(self.pk)
+        self.proven = []
+        for i in range(4):
+            ciphertext, r = self.pk.encrypt_return_r(self.plaintexts[i % 2])
+            proof = ciphertext.generate_disjunctive_encryption_proof(self.plaintexts, i % 2, r, algs.EG_disjunctive_challenge_generator)
+            self.proven.append((ciphertext, proof))
+
+    def _batch(self, proven):
+        proof_batch = batch.DisjunctiveProofBatch(self.pk)
+        for ciphertext, proof in proven:
+            self.assertTrue(proof_batch.add(ciphertext, self.plaintexts, proof, algs.EG_disjunctive_challenge_generator))
+        return proof_batch
+
+    def test_batch_accepts_valid_proofs(self):
+        self.assertTrue(self._batch(self.proven).verify())
+
+    def test_batch_rejects_bad_response(self):
+        self.proven[2][1].proofs[1].response += 1
+        self.assertFalse(self._batch(self.proven).verify())
+        self.assertTrue(self._batch(self.proven[:2]).verify())
+
+    def test_batch_rejects_commitment_outside_subgroup(self):
+        ciphertext, r = self.pk.encrypt_return_r(self.plaintexts[1])
+
+        # negate A of the simulated sub-proof before the overall challenge is hashed,
+        # so that only its order-2 component is wrong
+        def challenge_generator(commitments):
+            commitments[0]['A'] = self.pk.p - commitments[0]['A']
+            return algs.EG_disjunctive_challenge_generator(commitments)
+
+        proof = ciphertext.generate_disjunctive_encryption_proof(self.plaintexts, 1, r, challenge_generator)
+        self.assertFalse(ciphertext.verify_disjunctive_encryption_proof(self.plaintexts, proof, algs.EG_disjunctive_challenge_generator))
+
+        # whatever the random weights
+        for _ in range(20):
+            proof_batch = batch.DisjunctiveProofBatch(self.pk)
+            for other_ciphertext, other_proof in self.proven:
+                proof_batch.add(other_ciphertext, self.plaintexts, other_proof, algs.EG_disjunctive_challenge_generator)
+            proof_batch.add(ciphertext, self.plaintexts, proof, algs.EG_disjunctive_challenge_generator)
+            self.assertFalse(proof_batch.verify())
+
+    def test_answer_rejects_commitment_outside_subgroup(self):
+        answers = [homomorphic.EncryptedAnswer(choices=[ciphertext], individual_proofs=[proof]) for ciphertext, proof in self.proven[:2]]
+        forged_proof = answers[1].individual_proofs[0]
+        forged_proof.proofs[0].commitment['B'] = self.pk.p - forged_proof.proofs[0].commitment['B']
+
+        self.assertTrue(answers[0].verify(self.pk, max=None))
+        self.assertFalse(answers[1].verify(self.pk, max=None))
+
+        proof_batch = batch.DisjunctiveProofBatch(self.pk)
+        added = all([answer.add_to_batch(proof_batch, self.pk, max=None) for answer in answers])
+        self.assertFalse(added and proof_batch.verify())
+
+    def test_batch_rejects_bad_challenge_sum(self):
+        ciphertext, proof = self.proven[0]
+        proof.proofs[0].challenge += 1
+        proof_batch = batch.DisjunctiveProofBatch(self.pk)
+        self.assertFalse(proof_batch.add(ciphertext, self.plaintexts, proof, algs.EG_disjunctive_challenge_generator))
+        self.assertEqual(proof_batch.num_proofs, 0)
+
+    def test_verification_context(self):
+        context = homomorphic.VerificationContext.for_public_key(self.pk)
+        pk_copy = views.ELGAMAL_PARAMS.generate_keypair().pk
+        pk_copy.y = self.pk.y
+        self.assertIs(homomorphic.VerificationContext.for_public_key(pk_copy), context)
+
+        plaintexts, inverses = context.plaintexts(min=1, max=3)
+        self.assertEqual([plaintext.m for plaintext in plaintexts], [pow(self.pk.g, i, self.pk.p) for i in range(1, 4)])
+        self.assertEqual([(plaintext.m * inverse) % self.pk.p for plaintext, inverse in zip(plaintexts, inverses)], [1, 1, 1])
+        self.assertIs(context.plaintexts(min=1, max=3)[0], plaintexts)
+
+        plaintexts, inverses = context.plaintexts()
+        for ciphertext, proof in self.proven:
+            self.assertTrue(ciphertext.verify_disjunctive_encryption_proof(plaintexts, proof, algs.EG_disjunctive_challenge_generator, inverses))
+
+    def _membership(self, elements):
+        membership = batch.SubgroupMembershipBatch(self.pk.p, self.pk.q)
+        self.assertTrue(membership.add(elements))
+        return membership
+
+    def test_membership_batch(self):
+        p, q, g = self.pk.p, self.pk.q, self.pk.g
+        members = [pow(g, cryptoutils.random.mpz_lt(q), p) for _ in range(200)]
+
+        # few elements are checked one by one, many with random subsets
+        self.assertFalse(self._membership(members[:10])._batch_is_cheaper())
+        self.assertTrue(self._membership(members)._batch_is_cheaper())
+
+        for elements in (members[:10], members):
+            self.assertTrue(self._membership(elements).verify())
+
+            # order-2 components that would cancel out in a plain product
+            outsiders = list(elements)
+            outsiders[0] = p - outsiders[0]
+            outsiders[-1] = p - outsiders[-1]
+            self.assertFalse(self._membership(outsiders).verify())
+
+    def test_membership_batch_range(self):
+        membership = batch.SubgroupMembershipBatch(self.pk.p, self.pk.q)
+        self.assertFalse(membership.add([self.pk.g, 1]))
+        self.assertFalse(membership.add([self.pk.p - 1]))
+        self.assertEqual(len(membership.elements), 0)
+
+        ciphertext, proof = self.proven[0]
+        self.assertTrue(ciphertext.check_group_membership(self.pk))
+        ciphertext.alpha = self.pk.p - ciphertext.alpha
+        self.assertFalse(ciphertext.check_group_membership(self.pk))
+
+
+class MultiExpTests(TestCase):
+    def setUp(self):
+        self.pk = views.ELGAMAL_PARAMS.generate_keypair().pk
+        p, q = self.pk.p, self.pk.q
+        self.pairs = [(cryptoutils.random.mpz_lt(p), cryptoutils.random.mpz_lt(q)) for _ in range(3)]
+
+    def _product(self, pairs):
+        result = 1
+        for base, exponent in pairs:
+            result = (result * pow(base, exponent, self.pk.p)) % self.pk.p
+        return result
+
+    def test_straus_matches_pow(self):
+        for window in [1, 3, 5, None]:
+            self.assertEqual(multiexp.straus(self.pairs, self.pk.p, window), self._product(self.pairs))
+
+    def test_multi_powmod_negative_and_table_bases(self):
+        self.pk.precompute_tables()
+        pairs = self.pairs + [(self.pk.g, 5), (self.pk.y, -7), (self.pairs[0][0], -3), (self.pairs[1][0], 1)]
+        self.assertEqual(multiexp.multi_powmod(pairs, self.pk.p), self._product(pairs))
+
+    def test_products_equal(self):
+        (a, r), (b, c), (d, _) = self.pairs
+        right = (pow(a, r, self.pk.p) * pow(b, c, self.pk.p)) % self.pk.p
+        self.assertTrue(multiexp.products_equal([(a, r), (b, c)], [(right, 1)], self.pk.p))
+        self.assertTrue(multiexp.products_equal([(a, r)], [(right, 1), (pow(b, -1, self.pk.p), c)], self.pk.p))
+        self.assertFalse(multiexp.products_equal([(a, r), (d, c)], [(right, 1)], self.pk.p))
+
+    def test_products_equal_zero_base(self):
+        (a, r), (b, c), _ = self.pairs
+        left = pow(a, r, self.pk.p)
+        self.assertFalse(multiexp.products_equal([(a, r)], [(left, 1), (0, c)], self.pk.p))
+        self.assertFalse(multiexp.products_equal([(a, r), (b, c)], [(0, c)], self.pk.p))
+        self.assertTrue(multiexp.products_equal([(0, r)], [(0, c)], self.pk.p))
+
+        # a zero decryption factor or public key fails its proof rather than raising
+        proof = elgamal.ZKProof()
+        proof.commitment = {'A': a, 'B': b}
+        proof.challenge, proof.response = c, r
+        self.assertFalse(proof.verify(self.pk.g, a, self.pk.y, 0, self.pk.p, self.pk.q))
+
+        dlog_proof = elgamal.DLogProof(commitment=a, challenge=c, response=r)
+        zero_pk = elgamal.PublicKey()
+        zero_pk.p, zero_pk.q, zero_pk.g, zero_pk.y = self.pk.p, self.pk.q, self.pk.g, 0
+        self.assertFalse(zero_pk.verify_sk_proof(dlog_proof, lambda commitment: c))
+
+
+class DLogSolverTests(TestCase):
+    def setUp(self):
+        self.keypair = views.ELGAMAL_PARAMS.generate_keypair()
+        self.pk = self.keypair.pk
+
+    def test_lookup(self):
+        p, g = self.pk.p, self.pk.g
+        for up_to in [0, 1, 7, 100]:
+            solver = homomorphic.BSGSDLogSolver(g, p)
+            solver.precompute(up_to)
+            for dlog in range(up_to + 1):
+                self.assertEqual(solver.lookup(pow(g, dlog, p)), dlog)
+            self.assertIsNone(solver.lookup(pow(g, up_to + 1, p)))
+            self.assertIsNone(solver.lookup(pow(g, self.pk.q - 1, p)))
+
+    def test_matches_dlog_table(self):
+        table = homomorphic.DLogTable(self.pk.g, self.pk.p)
+        table.precompute(50)
+        solver = homomorphic.BSGSDLogSolver(self.pk.g, self.pk.p, baby_steps=3)
+        solver.precompute(50)
+        for value in table.dlogs:
+            self.assertEqual(solver.lookup(value), table.lookup(value))
+
+    def _tally(self, counts, num_tallied):
+        tally = homomorphic.Tally()
+        tally.tally = [[self.pk.encrypt_return_r(algs.EGPlaintext(pow(self.pk.g, count, self.pk.p), self.pk))[0] for count in counts]]
+        tally.num_tallied = num_tallied
+        factors = [[[self.keypair.sk.decryption_factor(ciphertext) for ciphertext in tally.tally[0]]]]
+        return tally, factors
+
+    def test_decrypt_from_factors(self):
+        tally, factors = self._tally([3, 0, 10], 10)
+        self.assertEqual(tally.decrypt_from_factors(factors, self.pk), [[3, 0, 10]])
+
+    def test_decrypt_out_of_range(self):
+        tally, factors = self._tally([3, 11], 10)
+        with self.assertRaises(homomorphic.DecryptionOutOfRange) as context:
+            tally.decrypt_from_factors(factors, self.pk)
+        self.assertEqual(context.exception.cells, [(0, 1)])
+
+    def test_file_table(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'dlog')
+            call_command('build_dlog_table', bound=40, path=path, stdout=io.StringIO())
+
+            table = dlogfile.open_table(path, views.ELGAMAL_PARAMS.g, views.ELGAMAL_PARAMS.p, 40)
+            for dlog in range(41):
+                self.assertEqual(table.lookup(pow(table.base, dlog, table.modulus)), dlog)
+            self.assertIsNone(table.lookup(pow(table.base, 41, table.modulus)))
+
+            table.precompute(10)
+            self.assertIsNone(table.lookup(pow(table.base, 11, table.modulus)))
+
+            # other parameters, or more ballots than the table covers
+            self.assertIsNone(dlogfile.open_table(path, views.ELGAMAL_PARAMS.g, views.ELGAMAL_PARAMS.p, 41))
+            self.assertIsNone(dlogfile.open_table(path, 2, views.ELGAMAL_PARAMS.p))
+
+            with self.settings(HELIOS_DLOG_TABLE=path):
+                tally, factors = self._tally([3, 0, 10], 10)
+                self.assertEqual(tally.decrypt_from_factors(factors, self.pk), [[3, 0, 10]])
+
+
+class BackendTests(TestCase):
+    def setUp(self):
+        self.engine = backend.get_engine()
+        self.p = views.ELGAMAL_PARAMS.p
+        self.x = cryptoutils.random.mpz_lt(self.p)
+
+    def tearDown(self):
+        backend.set_engine(self.engine.name)
+        fixedbase.clear()
+
+    def test_engines_agree(self):
+        results = {}
+        for name in backend.ENGINES:
+            if name == 'gmpy2' and backend.gmpy2 is None:
+                continue
+            backend.set_engine(name)
+            results[name] = [backend.powmod(self.x, 12345, self.p), backend.invert(self.x, self.p),
+                             backend.mulmod(self.x, self.x, self.p), backend.multi_powmod([(self.x, 3), (self.x + 1, -2)], self.p)]
+            for value in results[name]:
+                self.assertIs(type(value), int)
+        self.assertEqual(results['python'][0], pow(self.x, 12345, self.p))
+        self.assertEqual(len(set(map(tuple, results.values()))), 1)
+
+    def test_not_invertible(self):
+        for name in backend.ENGINES:
+            if name == 'gmpy2' and backend.gmpy2 is None:
+                continue
+            backend.set_engine(name)
+            self.assertRaises(ValueError, backend.invert, 0, self.p)
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, backend.set_engine, 'bogus')
+
+    def test_batch_invert(self):
+        values = [self.x, 1, self.p - 1, self.x + 1, 2]
+        for name in backend.ENGINES:
+            if name == 'gmpy2' and backend.gmpy2 is None:
+                continue
+            backend.set_engine(name)
+            self.assertEqual(backend.batch_invert(values, self.p), [pow(v, -1, self.p) for v in values])
+            self.assertEqual(backend.batch_invert([], self.p), [])
+            self.assertRaises(ValueError, backend.batch_invert, [self.x, 0], self.p)
+
 
 ##
 ## Black box tests
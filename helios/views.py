@@ -30,7 +30,7 @@ from . import forms
 from . import tasks
 from .crypto import algs, electionalgs, elgamal
 from .crypto import utils as cryptoutils
-from .models import User, Election, CastVote, Voter, VoterFile, Trustee, AuditedBallot
+from .models import User, Election, CastVote, Voter, VoterFile, Trustee, AuditedBallot, VoteCiphertexts
 from .security import (election_view, election_admin,
                        trustee_check, set_logged_in_trustee,
                        can_create_election, user_can_see_election, get_voter,
@@ -919,10 +919,14 @@ def one_election_cast_confirm(request, election):
     else:
       status_update_message = None
 
-    # launch the verification task
-    tasks.cast_vote_verify_and_store.delay(
-      cast_vote_id = cast_vote.id,
-      status_update_message = status_update_message)
+    # launch the verification task: one that takes a batch of the pending votes,
+    # unless there is a status update to post once this one is verified
+    if status_update_message:
+      tasks.cast_vote_verify_and_store.delay(
+        cast_vote_id = cast_vote.id,
+        status_update_message = status_update_message)
+    else:
+      tasks.cast_votes_verify_pending.delay()
     
     # remove the vote from the store
     del request.session['encrypted_vote']
@@ -1383,7 +1387,12 @@ def combine_decryptions(request, election):
   if request.method == "POST":
     check_csrf(request)
 
-    election.combine_decryptions()
+    try:
+      election.combine_decryptions()
+    except homomorphic.DecryptionOutOfRange as e:
+      logging.error("election %s: %s" % (election.uuid, e))
+      return render_template(request, 'combine_decryptions', {'election': election, 'out_of_range': e.cells})
+
     election.save()
 
     return HttpResponseRedirect(settings.SECURE_URL_HOST + reverse(url_names.election.ELECTION_VIEW, args=[election.uuid]))
@@ -1625,6 +1634,10 @@ def voters_eligibility(request, election):
   else:
     election.eligibility = None
 
+  # openreg is part of the election's fingerprint
+  if election.frozen_at:
+    election.election_hash = election.compute_hash()
+
   election.save()
   return HttpResponseRedirect(settings.SECURE_URL_HOST + reverse(voters_list_pretty, args=[election.uuid]))
   
@@ -1846,6 +1859,27 @@ def ballot_list(request, election):
   # we explicitly cast this to a short cast vote
   return [v.last_cast_vote().ld_object.short.toDict(complete=True) for v in voters]
 
+@election_view()
+@return_json
+def ballot_ciphertexts_list(request, election):
+  """
+  the choice ciphertexts of the voters' last ballots, ordered by voter UUID, for
+  verifiers that only recompute the tally. Each ballot's ciphertexts are the alpha and beta
+  of each choice of each answer in turn, as big-endian integers of width bytes, in base64.
+  Optionally takes limit and after, a voter UUID.
+  """
+  query = VoteCiphertexts.objects.filter(election = election).order_by('voter__uuid')
+  if 'after' in request.GET:
+    query = query.filter(voter__uuid__gt = request.GET['after'])
+  if 'limit' in request.GET:
+    query = query[:int(request.GET['limit'])]
+
+  return {
+    'width': homomorphic.ciphertext_width(election.public_key),
+    'ballots': [{'voter_uuid': voter_uuid, 'vote_hash': vote_hash, 'ciphertexts': base64.b64encode(bytes(ciphertexts)).decode()}
+                for voter_uuid, vote_hash, ciphertexts in query.values_list('voter__uuid', 'vote_hash', 'ciphertexts')]
+  }
+
 
 ##
 ## Email opt-out/opt-in views
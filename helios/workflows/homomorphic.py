@@ -7,9 +7,104 @@ reworked 2011-01-09
 """
 
 import logging
-from helios.crypto import algs
+import math
+import re
+
+from django.conf import settings
+
+from helios.crypto import algs, backend, batch, dlogfile, elgamal, fixedbase, randpool
 from . import WorkflowObject
 
+# bound on the memory used by the tally's discrete log table
+MAX_DLOG_BABY_STEPS = 1 << 20
+
+# the parts of a vote's JSON that hold its ciphertexts: the choices arrays,
+# the ciphertext objects in them, and their alpha and beta
+CHOICES_RE = re.compile(r'"choices"\s*:\s*\[([^\]]*)\]')
+CIPHERTEXT_RE = re.compile(r'\{[^{}]*\}')
+ALPHA_RE = re.compile(r'"alpha"\s*:\s*"(\d+)"')
+BETA_RE = re.compile(r'"beta"\s*:\s*"(\d+)"')
+
+def vote_ciphertexts(raw_vote):
+  """
+  the (alpha, beta) of each choice of each answer of a vote in its JSON wire format,
+  read straight from the JSON, without parsing the rest of the vote (its proofs in particular)
+  """
+  ciphertexts = []
+  for choices in CHOICES_RE.findall(raw_vote):
+    answer_ciphertexts = []
+    for ciphertext in CIPHERTEXT_RE.findall(choices):
+      alpha, beta = ALPHA_RE.search(ciphertext), BETA_RE.search(ciphertext)
+      if not alpha or not beta:
+        raise ValueError("malformed ciphertext in vote")
+      answer_ciphertexts.append((int(alpha.group(1)), int(beta.group(1))))
+    ciphertexts.append(answer_ciphertexts)
+
+  return ciphertexts
+
+def ciphertext_width(pk):
+  """
+  bytes per packed alpha or beta under pk
+  """
+  return (pk.p.bit_length() + 7) // 8
+
+def pack_ciphertexts(ciphertexts, width):
+  """
+  the (alpha, beta) of each choice of each answer of a vote, as width-byte big-endian integers one after the other
+  """
+  return b''.join(value.to_bytes(width, 'big') for answer_ciphertexts in ciphertexts for ciphertext in answer_ciphertexts for value in ciphertext)
+
+def unpack_ciphertexts(data, shape, width):
+  """
+  the ciphertexts packed by pack_ciphertexts, for answers with shape[i] choices each
+  """
+  if len(data) != 2 * width * sum(shape):
+    raise ValueError("packed ciphertexts do not match the election's questions")
+
+  values = iter([int.from_bytes(data[offset:offset + width], 'big') for offset in range(0, len(data), width)])
+  return [[(next(values), next(values)) for _ in range(num_choices)] for num_choices in shape]
+
+class VerificationContext(object):
+  """
+  What checking ballots under a public key needs that is the same for every ballot:
+  the key with its fixed-base tables, and for each range of answers to a question,
+  the plaintexts that a choice or a sum of choices may encrypt, and their inverses.
+  Get it with for_public_key(), which builds it once per key and process.
+  """
+
+  # contexts kept per process, by public key
+  MAX_CONTEXTS = 64
+  contexts = {}
+
+  def __init__(self, pk):
+    self.pk = pk
+    self.pk.precompute_tables()
+
+    # (min, max) -> (plaintexts, inverses)
+    self._plaintexts = {}
+
+  @classmethod
+  def for_public_key(cls, pk):
+    key = (pk.p, pk.q, pk.g, pk.y)
+    context = cls.contexts.get(key)
+    if context is None:
+      if len(cls.contexts) >= cls.MAX_CONTEXTS:
+        cls.contexts.clear()
+      context = cls.contexts[key] = cls(pk)
+
+    return context
+
+  def plaintexts(self, min=0, max=1):
+    """
+    the plaintexts g^min ... g^max and their inverses
+    """
+    if (min, max) not in self._plaintexts:
+      plaintexts = EncryptedAnswer.generate_plaintexts(self.pk, min=min, max=max)
+      inverses = backend.batch_invert([plaintext.m for plaintext in plaintexts], self.pk.p)
+      self._plaintexts[(min, max)] = (plaintexts, inverses)
+
+    return self._plaintexts[(min, max)]
+
 class EncryptedAnswer(WorkflowObject):
   """
   An encrypted answer to a single election question
@@ -55,8 +150,23 @@ class EncryptedAnswer(WorkflowObject):
     
     return False
     
-  def verify(self, pk, min=0, max=1):
-    possible_plaintexts = self.generate_plaintexts(pk)
+  def verify(self, pk, min=0, max=1, context=None):
+    context = context or VerificationContext.for_public_key(pk)
+    pk = context.pk
+
+    # all of the ciphertexts and proof commitments must be in the order-q subgroup
+    proofs = list(self.individual_proofs)
+    if max is not None:
+      proofs.append(self.overall_proof)
+
+    elements = [e for choice in self.choices for e in (choice.alpha, choice.beta)]
+    elements += [sub_proof.commitment[name] for proof in proofs for sub_proof in proof.proofs for name in ('A', 'B')]
+
+    membership = batch.SubgroupMembershipBatch(pk.p, pk.q)
+    if not membership.add(elements) or not membership.verify():
+      return False
+
+    possible_plaintexts, possible_plaintext_inverses = context.plaintexts()
     homomorphic_sum = 0
       
     for choice_num in range(len(self.choices)):
@@ -65,7 +175,8 @@ class EncryptedAnswer(WorkflowObject):
       individual_proof = self.individual_proofs[choice_num]
       
       # verify the proof on the encryption of that choice
-      if not choice.verify_disjunctive_encryption_proof(possible_plaintexts, individual_proof, algs.EG_disjunctive_challenge_generator):
+      if not choice.verify_disjunctive_encryption_proof(possible_plaintexts, individual_proof, algs.EG_disjunctive_challenge_generator,
+                                                        possible_plaintext_inverses):
         return False
 
       # compute homomorphic sum if needed
@@ -74,14 +185,43 @@ class EncryptedAnswer(WorkflowObject):
     
     if max is not None:
       # determine possible plaintexts for the sum
-      sum_possible_plaintexts = self.generate_plaintexts(pk, min=min, max=max)
+      sum_possible_plaintexts, sum_possible_plaintext_inverses = context.plaintexts(min=min, max=max)
 
       # verify the sum
-      return homomorphic_sum.verify_disjunctive_encryption_proof(sum_possible_plaintexts, self.overall_proof, algs.EG_disjunctive_challenge_generator)
+      return homomorphic_sum.verify_disjunctive_encryption_proof(sum_possible_plaintexts, self.overall_proof, algs.EG_disjunctive_challenge_generator,
+                                                                 sum_possible_plaintext_inverses)
     else:
       # approval voting, no need for overall proof verification
       return True
         
+  def add_to_batch(self, batch, pk, min=0, max=1, context=None):
+    """
+    same checks as verify(), except that the proof equations are deferred to a
+    DisjunctiveProofBatch. Returns False if one of the checks that are not deferred fails.
+    """
+    context = context or VerificationContext.for_public_key(pk)
+    pk = context.pk
+
+    possible_plaintexts, _ = context.plaintexts()
+    homomorphic_sum = 0
+
+    for choice_num in range(len(self.choices)):
+      choice = self.choices[choice_num]
+      choice.pk = pk
+      individual_proof = self.individual_proofs[choice_num]
+
+      if not batch.add(choice, possible_plaintexts, individual_proof, algs.EG_disjunctive_challenge_generator):
+        return False
+
+      if max is not None:
+        homomorphic_sum = choice * homomorphic_sum
+
+    if max is not None:
+      sum_possible_plaintexts, _ = context.plaintexts(min=min, max=max)
+      return batch.add(homomorphic_sum, sum_possible_plaintexts, self.overall_proof, algs.EG_disjunctive_challenge_generator)
+    else:
+      return True
+
   @classmethod
   def fromElectionAndAnswer(cls, election, question_num, answer_indexes):
     """
@@ -125,8 +265,7 @@ class EncryptedAnswer(WorkflowObject):
         num_selected_answers += 1
 
       # randomness and encryption
-      randomness[answer_num] = algs.random.mpz_lt(pk.q)
-      choices[answer_num] = pk.encrypt_with_r(plaintexts[plaintext_index], randomness[answer_num])
+      choices[answer_num], randomness[answer_num] = pk.encrypt_return_r(plaintexts[plaintext_index])
       
       # generate proof
       individual_proofs[answer_num] = choices[answer_num].generate_disjunctive_encryption_proof(plaintexts, plaintext_index, 
@@ -176,7 +315,10 @@ class EncryptedVote(WorkflowObject):
 
   answers = property(_answers_get, _answers_set)
 
-  def verify(self, election):
+  def verify_election(self, election):
+    """
+    checks that this ballot was prepared for this election, without looking at the proofs
+    """
     # correct number of answers
     # noinspection PyUnresolvedReferences
     n_answers = len(self.encrypted_answers) if self.encrypted_answers is not None else 0
@@ -201,6 +343,21 @@ class EncryptedVote(WorkflowObject):
       logging.error(f"Incorrect election_uuid {our_election_uuid} vs {actual_election_uuid} ")
       return False
 
+    return True
+
+  def choice_ciphertexts(self):
+    """
+    the (alpha, beta) of each choice of each answer
+    """
+    return [[(choice.alpha, choice.beta) for choice in answer.choices] for answer in self.encrypted_answers]
+
+  def verify(self, election, context=None):
+    if not self.verify_election(election):
+      return False
+
+    # what all of the ballots of the election have in common, fixed-base tables included
+    context = context or VerificationContext.for_public_key(election.public_key)
+
     # check proofs on all of answers
     for question_num in range(len(election.questions)):
       ea = self.encrypted_answers[question_num]
@@ -210,14 +367,67 @@ class EncryptedVote(WorkflowObject):
       if 'min' in question:
         min_answers = question['min']
         
-      if not ea.verify(election.public_key, min=min_answers, max=question['max']):
+      if not ea.verify(election.public_key, min=min_answers, max=question['max'], context=context):
         return False
         
     return True
+
+  def add_to_batch(self, election, batch, context=None):
+    """
+    checks this ballot like verify() does, but defers its proofs to the batch
+    """
+    context = context or VerificationContext.for_public_key(election.public_key)
+
+    if not self.verify_election(election):
+      return False
+
+    for question_num in range(len(election.questions)):
+      question = election.questions[question_num]
+      min_answers = 0
+      if 'min' in question:
+        min_answers = question['min']
+
+      if not self.encrypted_answers[question_num].add_to_batch(batch, election.public_key, min=min_answers, max=question['max'], context=context):
+        return False
+
+    return True
+
+  @classmethod
+  def verify_batch(cls, election, encrypted_votes):
+    """
+    Verify many ballots for the same election with one aggregate proof verification.
+    Returns a list of booleans, one per ballot. If the batch as a whole does not check out,
+    it is split in halves until the bad ballots are pinned down.
+    """
+    encrypted_votes = list(encrypted_votes)
+    context = VerificationContext.for_public_key(election.public_key)
+    if len(encrypted_votes) <= 1:
+      return [vote.verify(election, context=context) for vote in encrypted_votes]
+
+    proof_batch = batch.DisjunctiveProofBatch(context.pk)
+    results = [vote.add_to_batch(election, proof_batch, context=context) for vote in encrypted_votes]
+
+    if proof_batch.verify():
+      return results
+
+    # only the ballots that passed the structural checks need another look
+    candidates = [vote_num for vote_num, result in enumerate(results) if result]
+    half = len(candidates) // 2
+    for group in (candidates[:half], candidates[half:]):
+      group_results = cls.verify_batch(election, [encrypted_votes[vote_num] for vote_num in group])
+      for vote_num, result in zip(group, group_results):
+        results[vote_num] = result
+
+    return results
     
   @classmethod
   def fromElectionAndAnswers(cls, election, answers):
     pk = election.public_key
+    pk.precompute_tables()
+
+    # ballots generated server-side take their randomness from a pool filled in the background
+    if settings.HELIOS_RANDOMNESS_POOL_SIZE:
+      randpool.get_pool(pk, settings.HELIOS_RANDOMNESS_POOL_SIZE).start()
 
     # each answer is an index into the answer array
     encrypted_answers = [EncryptedAnswer.fromElectionAndAnswer(election, answer_num, answers[answer_num]) for answer_num in range(len(answers))]
@@ -261,7 +471,79 @@ class DLogTable(object):
   
   def lookup(self, value):
     return self.dlogs.get(value, None)
-      
+
+
+class BSGSDLogSolver(object):
+  """
+  Discrete logs in [0, up_to] by baby-step giant-step, with the same interface as DLogTable.
+
+  Only the baby steps base^j, j < baby_steps, are stored, keyed by their low 64 bits.
+  A lookup then walks value * base^(-baby_steps * i) until it hits a baby step, so it takes
+  at most up_to / baby_steps multiplications. With baby_steps ~ sqrt(up_to) both the table
+  and each lookup are O(sqrt(up_to)); when there are many values to look up, a bigger
+  table makes each lookup cheaper.
+  """
+
+  KEY_MASK = (1 << 64) - 1
+
+  def __init__(self, base, modulus, baby_steps=None):
+    self.base = base
+    self.modulus = modulus
+    self.baby_steps = baby_steps
+
+    self.up_to = None
+    self.dlogs = None
+    self.giant_step = None
+
+  def precompute(self, up_to):
+    self.up_to = up_to
+    if not self.baby_steps:
+      self.baby_steps = math.isqrt(up_to) + 1
+
+    modulus = backend.native(self.modulus)
+    base = backend.native(self.base)
+
+    # baby steps: low bits of base^j -> j
+    self.dlogs = {}
+    value = backend.native(1)
+    for j in range(self.baby_steps):
+      self.dlogs.setdefault(int(value & self.KEY_MASK), j)
+      value = (value * base) % modulus
+
+    # value is now base^baby_steps
+    self.giant_step = backend.native(backend.invert(int(value), self.modulus))
+
+  def lookup(self, value):
+    """
+    the discrete log of value if it is in [0, up_to], None otherwise
+    """
+    modulus = backend.native(self.modulus)
+    current = backend.native(value) % modulus
+
+    for i in range(self.up_to // self.baby_steps + 1):
+      j = self.dlogs.get(int(current & self.KEY_MASK))
+
+      # only the low bits are keyed, so a hit is confirmed with the full value
+      if j is not None:
+        dlog = i * self.baby_steps + j
+        if dlog <= self.up_to and fixedbase.powmod(self.base, dlog, self.modulus) == value % self.modulus:
+          return dlog
+
+      current = (current * self.giant_step) % modulus
+
+    return None
+
+
+class DecryptionOutOfRange(Exception):
+  """
+  decrypted tally values that are not a count between 0 and the number of ballots
+  """
+
+  def __init__(self, cells, num_tallied):
+    self.cells = cells
+    self.num_tallied = num_tallied
+    super(DecryptionOutOfRange, self).__init__("decrypted tally out of range [0, %s] for (question, answer) %s" % (num_tallied, cells))
+
     
 class Tally(WorkflowObject):
   """
@@ -294,14 +576,26 @@ class Tally(WorkflowObject):
     self.election = election
     self.questions = election.questions
     self.public_key = election.public_key
+
+    # a tally read back from the database doesn't know the key of its ciphertexts
+    for question_tally in self.tally or []:
+      for ciphertext in question_tally:
+        if isinstance(ciphertext, elgamal.Ciphertext):
+          ciphertext.pk = self.public_key
     
   def add_vote_batch(self, encrypted_votes, verify_p=True):
     """
-    Add a batch of votes. Eventually, this will be optimized to do an aggregate proof verification
+    Add a batch of votes, with an aggregate proof verification
     rather than a whole proof verif for each vote.
     """
+    encrypted_votes = list(encrypted_votes)
+
+    if verify_p:
+      if not all(EncryptedVote.verify_batch(self.election, encrypted_votes)):
+        raise Exception('Bad Vote')
+
     for vote in encrypted_votes:
-      self.add_vote(vote, verify_p)
+      self.add_vote(vote, verify_p=False)
     
   def add_vote(self, encrypted_vote, verify_p=True):
     # do we verify?
@@ -323,6 +617,98 @@ class Tally(WorkflowObject):
 
     self.num_tallied += 1
 
+  def add_raw_votes(self, raw_votes):
+    """
+    Add votes in their JSON wire format, which must have been verified already.
+    Only the votes' ciphertexts are read, never their proofs.
+    """
+    self.add_ciphertexts(vote_ciphertexts(raw_vote) for raw_vote in raw_votes)
+
+  def add_ciphertexts(self, votes_ciphertexts):
+    """
+    Add the choice ciphertexts of votes, as lists of (alpha, beta) per answer, of votes
+    that must have been verified already. The products are kept in the backend's
+    representation until the end, so a stream of votes is added in constant memory.
+    """
+    p = backend.native(self.public_key.p)
+    one = backend.native(1)
+    shape = [len(question['answers']) for question in self.questions]
+
+    products = [[(one, one) if isinstance(ciphertext, int) else (backend.native(ciphertext.alpha), backend.native(ciphertext.beta))
+                 for ciphertext in question_tally] for question_tally in self.tally]
+
+    num_added = 0
+    for ciphertexts in votes_ciphertexts:
+      if [len(answer_ciphertexts) for answer_ciphertexts in ciphertexts] != shape:
+        raise ValueError("vote does not match the election's questions")
+
+      for question_products, answer_ciphertexts in zip(products, ciphertexts):
+        for answer_num, (alpha, beta) in enumerate(answer_ciphertexts):
+          product_alpha, product_beta = question_products[answer_num]
+          question_products[answer_num] = ((product_alpha * alpha) % p, (product_beta * beta) % p)
+
+      num_added += 1
+
+    if not num_added:
+      return
+
+    self.tally = [[elgamal.Ciphertext(alpha=int(alpha), beta=int(beta), pk=self.public_key) for alpha, beta in question_products]
+                  for question_products in products]
+    self.num_tallied += num_added
+
+  def add_tally(self, other):
+    """
+    Add in another tally of the same election, e.g. the partial tally of some of the voters
+    """
+    for question_num, question in enumerate(self.questions):
+      for answer_num in range(len(question['answers'])):
+        ciphertext = other.tally[question_num][answer_num]
+
+        # nothing was added to this cell
+        if isinstance(ciphertext, int):
+          continue
+
+        ciphertext.pk = self.public_key
+        self.tally[question_num][answer_num] = ciphertext * self.tally[question_num][answer_num]
+
+    self.num_tallied += other.num_tallied
+
+  def remove_vote(self, encrypted_vote):
+    """
+    Take a vote that was added to the tally back out of it, e.g. when the voter
+    casts another one, by dividing its ciphertexts out of the tally's.
+    """
+    self.remove_ciphertexts(encrypted_vote.choice_ciphertexts())
+
+  def remove_ciphertexts(self, ciphertexts):
+    """
+    Take the choice ciphertexts of a vote, as lists of (alpha, beta) per answer, back out of the tally
+    """
+    p = self.public_key.p
+
+    # the choices in tally order, with all of their inverses at once
+    choices = [ciphertexts[question_num][answer_num]
+               for question_num, question in enumerate(self.questions)
+               for answer_num in range(len(question['answers']))]
+    inverses = backend.batch_invert([value for choice in choices for value in choice], p)
+
+    choice_num = 0
+    for question_num, question in enumerate(self.questions):
+      for answer_num in range(len(question['answers'])):
+        ciphertext = self.tally[question_num][answer_num]
+
+        # nothing was added to this cell, e.g. in a change to a tally that only removes votes
+        if isinstance(ciphertext, int):
+          ciphertext = elgamal.Ciphertext(alpha = 1, beta = 1, pk = self.public_key)
+
+        self.tally[question_num][answer_num] = elgamal.Ciphertext(
+          alpha = backend.mulmod(ciphertext.alpha, inverses[2 * choice_num], p),
+          beta = backend.mulmod(ciphertext.beta, inverses[2 * choice_num + 1], p),
+          pk = self.public_key)
+        choice_num += 1
+
+    self.num_tallied -= 1
+
   def decryption_factors_and_proofs(self, sk):
     """
     returns an array of decryption factors and a corresponding array of decryption proofs.
@@ -331,6 +717,9 @@ class Tally(WorkflowObject):
     # for all choices of all questions (double list comprehension)
     decryption_factors = []
     decryption_proof = []
+
+    # every decryption proof commits to a power of g
+    fixedbase.precompute(sk.pk.g, sk.pk.p, sk.pk.q.bit_length())
     
     for question_num, question in enumerate(self.questions):
       answers = question['answers']
@@ -411,24 +800,45 @@ class Tally(WorkflowObject):
     Each decryption factor set is a list of lists of decryption factors (questions/answers).
     """
     
-    # pre-compute a dlog table
-    dlog_table = DLogTable(base = public_key.g, modulus = public_key.p)
+    # the instance's shared table if it covers this election, otherwise
+    # a dlog table sized so that every cell costs about as much as the table
+    dlog_table = dlogfile.open_table(settings.HELIOS_DLOG_TABLE, public_key.g, public_key.p, self.num_tallied)
+    if dlog_table is None:
+      num_cells = sum(len(q) for q in self.tally)
+      baby_steps = min(math.isqrt(num_cells * (self.num_tallied + 1)) + 1, MAX_DLOG_BABY_STEPS, self.num_tallied + 1)
+      dlog_table = BSGSDLogSolver(base = public_key.g, modulus = public_key.p, baby_steps = baby_steps)
     dlog_table.precompute(self.num_tallied)
     
+    # multiply the trustees' decryption factors of each cell, then invert them all in one batch
+    factor_products = []
+    for q_num, q in enumerate(self.tally):
+      for a_num, a in enumerate(q):
+        factors_product = 1
+        for df in decryption_factors:
+          factors_product = backend.mulmod(factors_product, df[q_num][a_num], public_key.p)
+        factor_products.append(factors_product)
+    factor_inverses = iter(backend.batch_invert(factor_products, public_key.p))
+
     result = []
+    out_of_range = []
     
     # go through each one
     for q_num, q in enumerate(self.tally):
       q_result = []
 
       for a_num, a in enumerate(q):
-        # coalesce the decryption factors into one list
-        dec_factor_list = [df[q_num][a_num] for df in decryption_factors]
-        raw_value = self.tally[q_num][a_num].decrypt(dec_factor_list, public_key)
+        # same as a.decrypt() with the factors of every trustee
+        raw_value = backend.mulmod(a.beta, next(factor_inverses), public_key.p)
         
-        q_result.append(dlog_table.lookup(raw_value))
+        dlog = dlog_table.lookup(raw_value)
+        if dlog is None:
+          out_of_range.append((q_num, a_num))
+        q_result.append(dlog)
 
       result.append(q_result)
+
+    if out_of_range:
+      raise DecryptionOutOfRange(out_of_range, self.num_tallied)
     
     return result
 
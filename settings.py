@@ -268,6 +268,29 @@ HELIOS_VOTER_EMAIL_CUTOFF_WEEKS = int(get_from_env('HELIOS_VOTER_EMAIL_CUTOFF_WE
 # are elections private by default?
 HELIOS_PRIVATE_DEFAULT = False
 
+# worker processes of the verify_cast_votes command, 0 means one per CPU
+HELIOS_VERIFY_WORKERS = int(get_from_env('HELIOS_VERIFY_WORKERS', '0'))
+
+# cast votes claimed by each batch verification task
+HELIOS_VERIFY_BATCH_SIZE = int(get_from_env('HELIOS_VERIFY_BATCH_SIZE', '100'))
+
+# precomputed encryption randomness kept per public key for ballots generated server-side
+# (load tests, kiosks), filled by a background process. 0 disables the pools
+HELIOS_RANDOMNESS_POOL_SIZE = int(get_from_env('HELIOS_RANDOMNESS_POOL_SIZE', '0'))
+
+# celery queue of the notifications sent once cast votes are verified,
+# so that slow email or messaging providers do not hold up verification
+HELIOS_NOTIFICATION_QUEUE = get_from_env('HELIOS_NOTIFICATION_QUEUE', 'notifications')
+
+# processes used by the Helios trustee to decrypt the tally in parallel, 0 means one per CPU
+HELIOS_DECRYPT_WORKERS = int(get_from_env('HELIOS_DECRYPT_WORKERS', '0'))
+
+# voters per task when the tally of an election is computed from its ballots
+HELIOS_TALLY_SHARD_SIZE = int(get_from_env('HELIOS_TALLY_SHARD_SIZE', '10000'))
+
+# discrete log table built by the build_dlog_table command, shared by all processes
+HELIOS_DLOG_TABLE = get_from_env('HELIOS_DLOG_TABLE', None)
+
 # authentication systems enabled
 # AUTH_ENABLED_SYSTEMS = ['password','facebook', 'google', 'yahoo']
 AUTH_ENABLED_SYSTEMS = get_from_env('AUTH_ENABLED_SYSTEMS',
@@ -334,6 +357,10 @@ if TESTING:
     CELERY_TASK_ALWAYS_EAGER = True
 else:
     CELERY_TASK_ALWAYS_EAGER = (get_from_env('CELERY_TASK_ALWAYS_EAGER', '0') == '1')
+CELERY_TASK_ROUTES = {
+    'helios.tasks.cast_votes_notify': {'queue': HELIOS_NOTIFICATION_QUEUE},
+    'helios.tasks.cast_votes_update_status': {'queue': HELIOS_NOTIFICATION_QUEUE},
+}
 
 # Rollbar Error Logging
 ROLLBAR_ACCESS_TOKEN = get_from_env('ROLLBAR_ACCESS_TOKEN', None)